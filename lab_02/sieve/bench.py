@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import argparse
+import numpy as np
+from timeit import default_timer as timer
+from dataclasses import dataclass
+from main import compute_primes_up_to, compute_primes_in_interval, compute_primes_in_interval_naive, compute_primes_in_interval_wheel
+
+
+KERNELS = {
+    'naive': compute_primes_in_interval_naive,
+    'segmented': compute_primes_in_interval,
+    'wheel': compute_primes_in_interval_wheel,
+}
+
+
+def build_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="sieve-bench")
+    parser.add_argument('--upper-bounds', type=int, nargs='+', default=[10 ** 7, 10 ** 8, 10 ** 9], dest='upper_bounds', help='Upper bounds to benchmark the kernels at')
+    parser.add_argument('--window', type=int, default=10 ** 5, dest='window', help='Length of the interval (ending at the upper bound) handed to the kernels. '
+                        'The naive kernel is far too slow to sieve whole worker intervals at 10^9')
+    parser.add_argument('--kernels', type=str, nargs='+', default=list(KERNELS.keys()), choices=list(KERNELS.keys()), dest='kernels', help='Kernels to run')
+    return parser
+
+
+@dataclass
+class Args:
+    upper_bounds: list
+    window: int
+    kernels: list
+
+
+def main():
+    args: Args = build_cli().parse_args()
+
+    print('kernel,upper_bound,window,time')
+    for upper_bound in args.upper_bounds:
+        factors_B = compute_primes_up_to(int(np.sqrt(upper_bound)))
+        lower = max(upper_bound - args.window + 1, int(np.sqrt(upper_bound)) + 1)
+        results = []
+        for kernel in args.kernels:
+            start_time = timer()
+            primes = KERNELS[kernel](lower, upper_bound, factors_B)
+            elapsed = timer() - start_time
+            results.append(primes)
+            print(f'{kernel},{upper_bound},{upper_bound - lower + 1},{elapsed * 1000}')
+        # Kernels must be interchangeable
+        for primes in results[1:]:
+            assert np.array_equal(results[0], primes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import numpy as np
+from pathlib import Path
+from mpi4py import MPI
+from dataclasses import dataclass
+from typing import Optional
+from main import compute_primes_up_to, build_chunks, self_scheduled_worker
+from wheel import WHEEL, RESIDUES, POPCOUNT, SEGMENT_BYTES, WHEEL_PRIMES, iter_wheel_segments
+
+
+BITS_FILE = 'primes.bits'
+INDEX_FILE = 'index.npy'
+RESIDUE_INDEX = {int(r): k for k, r in enumerate(RESIDUES)}
+# Index columns
+COL_BYTE_START = 0
+COL_BYTE_END = 1
+COL_PRIMES_BEFORE = 2
+
+
+@dataclass
+class PrimeCache:
+    """
+    Wheel bits (see `wheel.WheelSieve`) of all primes starting from 0, kept in a memory-mapped file.
+    Index row i describes segment i: [first byte, past-the-end byte, number of primes in the preceding segments].
+    Only the segment a query falls into is ever read from disk.
+    """
+    cache_dir: Path
+    index: np.ndarray
+    bits: Optional[np.memmap]
+
+    @staticmethod
+    def open(cache_dir: Path) -> 'PrimeCache':
+        index_path = cache_dir.joinpath(INDEX_FILE)
+        if not index_path.exists():
+            return PrimeCache(cache_dir, np.empty((0, 3), dtype=np.int64), None)
+        index = np.load(index_path)
+        bits = None
+        if len(index) > 0:
+            bits = np.memmap(cache_dir.joinpath(BITS_FILE), dtype=np.uint8, mode='r', shape=(int(index[-1, COL_BYTE_END]),))
+        return PrimeCache(cache_dir, index, bits)
+
+    def covered_upper(self) -> int:
+        """
+        :return: largest number the cache answers queries for, -1 if it is empty
+        """
+        if len(self.index) == 0:
+            return -1
+        return WHEEL * int(self.index[-1, COL_BYTE_END]) - 1
+
+    def total_primes(self) -> int:
+        if len(self.index) == 0:
+            return 0
+        last = self.index[-1]
+        return len(WHEEL_PRIMES) + int(last[COL_PRIMES_BEFORE]) + self._popcount(int(last[COL_BYTE_START]), int(last[COL_BYTE_END]))
+
+    def _popcount(self, byte_start: int, byte_end: int) -> int:
+        return int(POPCOUNT[self.bits[byte_start:byte_end]].sum(dtype=np.int64))
+
+    def count_primes(self, n: int) -> int:
+        """
+        :return: pi(n), number of primes <= n
+        """
+        if n > self.covered_upper():
+            raise ValueError(f'Cache covers numbers up to {self.covered_upper()}, cannot count primes up to {n}')
+        count = int(np.sum(WHEEL_PRIMES <= n))
+        if n < RESIDUES[1]:
+            return count
+        byte = n // WHEEL
+        segment = np.searchsorted(self.index[:, COL_BYTE_END], byte, side='right')
+        byte_start = int(self.index[segment, COL_BYTE_START])
+        count += int(self.index[segment, COL_PRIMES_BEFORE]) + self._popcount(byte_start, byte)
+        # Partial last byte
+        last_byte_bits = np.unpackbits(self.bits[byte:byte + 1], bitorder='little')
+        count += int(np.sum(last_byte_bits[RESIDUES <= n % WHEEL]))
+        return count
+
+    def nth_prime(self, k: int) -> int:
+        """
+        :param k: 1-based, nth_prime(1) == 2
+        """
+        if k < 1 or k > self.total_primes():
+            raise ValueError(f'Cache holds {self.total_primes()} primes, cannot find prime number {k}')
+        if k <= len(WHEEL_PRIMES):
+            return int(WHEEL_PRIMES[k - 1])
+        k -= len(WHEEL_PRIMES)
+        segment = np.searchsorted(self.index[:, COL_PRIMES_BEFORE], k, side='left') - 1
+        byte_start, byte_end, primes_before = (int(v) for v in self.index[segment])
+        survived = np.flatnonzero(np.unpackbits(self.bits[byte_start:byte_end], bitorder='little'))
+        position = survived[k - primes_before - 1]
+        return WHEEL * (byte_start + position // len(RESIDUES)) + int(RESIDUES[position % len(RESIDUES)])
+
+
+def extend_cache(comm, cache_dir: Path, upper_bound: int, segment_bytes: int = SEGMENT_BYTES) -> PrimeCache:
+    """
+    Makes the cache cover at least [0, upper_bound]. Segments already on disk are reused,
+    only the missing tail is sieved - by all ranks, pulling segments on demand and writing
+    them straight into the memory-mapped file at their offsets.
+    Bits are written before the index, so an interrupted extension leaves a valid (shorter) cache.
+    """
+    rank = comm.Get_rank()
+    cache = PrimeCache.open(cache_dir)
+    if cache.covered_upper() >= upper_bound:
+        return cache
+
+    first_byte = int(cache.index[-1, COL_BYTE_END]) if len(cache.index) > 0 else 0
+    n_new_segments = int(np.ceil((upper_bound // WHEEL + 1 - first_byte) / segment_bytes))
+    last_byte = first_byte + n_new_segments * segment_bytes
+    factors = compute_primes_up_to(int(np.sqrt(WHEEL * last_byte)))
+
+    bits_path = cache_dir.joinpath(BITS_FILE)
+    if rank == 0:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(bits_path, 'ab') as bits_file:
+            bits_file.truncate(last_byte)
+    comm.Barrier()
+    bits = np.memmap(bits_path, dtype=np.uint8, mode='r+', shape=(last_byte,))
+
+    def sieve_segment(lower: int, upper: int, factors_B) -> int:
+        # Segment sieve of [lower, upper] with `factors_B` crosses off the factors themselves, restore them
+        segment_factors = factors_B[(factors_B >= lower) & (factors_B <= upper) & (factors_B > WHEEL_PRIMES[-1])]
+        count = 0
+        for segment in iter_wheel_segments(lower, upper, factors_B, segment_bytes):
+            segment_bits = bits[segment.base // WHEEL:segment.base // WHEEL + len(segment.bits)]
+            segment_bits[:] = segment.bits
+            for p in segment_factors:
+                segment_bits[(p - segment.base) // WHEEL] |= np.uint8(1 << RESIDUE_INDEX[int(p) % WHEEL])
+            if segment.base == 0:
+                # 1 is not a prime
+                segment_bits[0] &= np.uint8(0xFE)
+            count += int(POPCOUNT[segment_bits].sum(dtype=np.int64))
+        return count
+
+    chunk_numbers = WHEEL * segment_bytes
+    chunks = build_chunks(WHEEL * first_byte, WHEEL * last_byte - 1, comm.Get_size(), 'dynamic', chunk_numbers)
+    segment_counts = self_scheduled_worker(comm, chunks, factors, sieve_segment)
+    bits.flush()
+    del bits
+
+    gathered = comm.gather(segment_counts, root=0)
+    if rank == 0:
+        for counts in gathered[1:]:
+            segment_counts.update(counts)
+        new_index = np.zeros((n_new_segments, 3), dtype=np.int64)
+        new_index[:, COL_BYTE_START] = first_byte + segment_bytes * np.arange(n_new_segments)
+        new_index[:, COL_BYTE_END] = new_index[:, COL_BYTE_START] + segment_bytes
+        counts = np.array([segment_counts[i] for i in range(n_new_segments)], dtype=np.int64)
+        primes_before = cache.total_primes() - len(WHEEL_PRIMES) if len(cache.index) > 0 else 0
+        new_index[:, COL_PRIMES_BEFORE] = primes_before + np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        index_path = cache_dir.joinpath(INDEX_FILE)
+        tmp_path = cache_dir.joinpath(INDEX_FILE + '.tmp')
+        with open(tmp_path, 'wb') as tmp_file:
+            np.save(tmp_file, np.concatenate((cache.index, new_index)))
+        os.replace(tmp_path, index_path)
+    comm.Barrier()
+    return PrimeCache.open(cache_dir)
+
+
+def build_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="sieve-cache")
+    parser.add_argument('--cache-dir', type=Path, required=True, dest='cache_dir', help='Directory holding the cached sieve')
+    parser.add_argument('--upper-bound', type=int, default=None, dest='upper_bound', help='Extend the cache to cover primes up to this number')
+    parser.add_argument('--count', type=int, nargs='*', default=[], dest='count', help='Print pi(n) for every given n')
+    parser.add_argument('--nth', type=int, nargs='*', default=[], dest='nth', help='Print the k-th prime for every given k')
+    return parser
+
+
+@dataclass
+class Args:
+    cache_dir: Path
+    upper_bound: Optional[int]
+    count: list
+    nth: list
+
+
+def nth_prime_upper_bound(k: int) -> int:
+    # Rosser's theorem: p_k < k (ln k + ln ln k) for k >= 6
+    if k < 6:
+        return 13
+    return int(k * (np.log(k) + np.log(np.log(k)))) + 1
+
+
+def main():
+    args: Args = build_cli().parse_args()
+    comm = MPI.COMM_WORLD
+
+    upper_bound = max([args.upper_bound or 0] + args.count + [nth_prime_upper_bound(k) for k in args.nth])
+    cache = extend_cache(comm, args.cache_dir, upper_bound)
+
+    if comm.Get_rank() == 0:
+        for n in args.count:
+            print(f'pi({n}) = {cache.count_primes(n)}')
+        for k in args.nth:
+            print(f'p_{k} = {cache.nth_prime(k)}')
+
+    MPI.Finalize()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,27 @@
 #!/usr/bin/env python
 
 import numpy as np
-import sys
+import argparse
 from mpi4py import MPI
+from pathlib import Path
+from typing import Optional
+from dataclasses import dataclass
+from output import FORMATS, PrimeWriter, write_manifest
+from wheel import sieve_interval_wheel, iter_wheel_segments, missing_wheel_primes
 
 
 def compute_primes_up_to(upper_bound: int):
+    """
+    Sieves the primes up to sqrt(upper_bound) densely, the rest with the bit-packed wheel.
+    """
+    limit = int(np.sqrt(upper_bound))
+    if limit < 5:
+        return compute_primes_up_to_dense(upper_bound)
+    base_primes = compute_primes_up_to_dense(limit)
+    return np.concatenate((base_primes, sieve_interval_wheel(limit + 1, upper_bound, base_primes).to_array()))
+
+
+def compute_primes_up_to_dense(upper_bound: int):
     numbers = np.arange(upper_bound + 1, dtype=int)
     mask = np.ones_like(numbers, dtype=bool)
     mask[0:2] = False
@@ -15,7 +31,44 @@ def compute_primes_up_to(upper_bound: int):
     return numbers[mask]
 
 
-def compute_primes_in_interval(lower: int, upper: int, factors: list):
+# Numbers covered by a single segment of the interval sieve. One bool per number,
+# so this keeps the working mask at 256 KiB, which fits in L2 on the cluster nodes.
+SEGMENT_SIZE = 1 << 18
+# Default length of a chunk handed out by the dynamic schedules
+CHUNK_SIZE = 1 << 20
+# Guided schedule hands out `remaining / (GUIDED_FACTOR * size)` numbers at once
+GUIDED_FACTOR = 2
+
+
+def compute_primes_in_interval(lower: int, upper: int, factors: list, segment_size: int = SEGMENT_SIZE):
+    """
+    Segmented sieve: crosses off multiples of every factor with strided slices.
+    Gives the same result as `compute_primes_in_interval_naive`, i.e. keeps numbers
+    from [lower, upper] not divisible by any of `factors`.
+    """
+    factors = np.asarray(factors, dtype=np.int64)
+    segments = []
+    for seg_lower in range(lower, upper + 1, segment_size):
+        seg_upper = min(seg_lower + segment_size - 1, upper)
+        mask = np.ones(seg_upper - seg_lower + 1, dtype=bool)
+        # Offset of the first multiple of every factor inside the segment
+        offsets = (-seg_lower) % factors
+        for d, offset in zip(factors, offsets):
+            mask[offset::d] = False
+        segments.append(np.flatnonzero(mask) + seg_lower)
+    if len(segments) == 0:
+        return np.empty(0, dtype=int)
+    return np.concatenate(segments)
+
+
+def compute_primes_in_interval_wheel(lower: int, upper: int, factors: list):
+    """
+    Same result as `compute_primes_in_interval`, but the sieve itself takes one byte per 30 integers.
+    """
+    return np.concatenate((missing_wheel_primes(lower, upper, factors), sieve_interval_wheel(lower, upper, factors).to_array()))
+
+
+def compute_primes_in_interval_naive(lower: int, upper: int, factors: list):
     numbers = np.arange(lower, upper + 1, dtype=int)
     mask = np.ones_like(numbers, dtype=bool)
     for n in numbers:
@@ -44,15 +97,162 @@ def master(comm, size, limit_B, upper_bound):
     comm.send({'lower': lower_i, 'upper': upper_bound}, dest=last_worker_rank)
 
 
-def worker(comm, factors_B, master_rank):
+def count_primes_in_interval(lower: int, upper: int, factors: list) -> tuple:
+    """
+    :return: (count, sum) of the primes in [lower, upper]. Sieved segment by segment with the wheel,
+        so the memory used does not depend on the interval length
+    """
+    wheel_primes = missing_wheel_primes(lower, upper, factors)
+    count, total = len(wheel_primes), int(wheel_primes.sum())
+    for segment in iter_wheel_segments(lower, upper, factors):
+        count += segment.count()
+        total += sum(int(primes.sum()) for primes in segment.iter_primes())
+    return count, total
+
+
+def worker(comm, factors_B, master_rank, kernel=compute_primes_in_interval):
     # Point 3
     message = comm.recv(source=master_rank)
     lower_bound, upper_bound = message['lower'], message['upper']
-    computed_primes = compute_primes_in_interval(lower_bound, upper_bound, factors_B)
-    comm.send(computed_primes, dest=master_rank)
+    return kernel(lower_bound, upper_bound, factors_B)
+
+
+def build_chunks(lower: int, upper: int, size: int, schedule: str, chunk_size: int) -> list:
+    """
+    Splits [lower, upper] into chunks handed out on demand.
+
+    :param schedule: `dynamic` - chunks of equal `chunk_size` length,
+        `guided` - chunk length proportional to the remaining work, but not smaller than `chunk_size`
+    """
+    chunks = []
+    chunk_lower = lower
+    while chunk_lower <= upper:
+        if schedule == 'guided':
+            remaining = upper - chunk_lower + 1
+            length = max(chunk_size, int(np.ceil(remaining / (GUIDED_FACTOR * size))))
+        else:
+            length = chunk_size
+        chunk_upper = min(chunk_lower + length - 1, upper)
+        chunks.append((chunk_lower, chunk_upper))
+        chunk_lower = chunk_upper + 1
+    return chunks
+
+
+def self_scheduled_worker(comm, chunks: list, factors_B, kernel=compute_primes_in_interval) -> dict:
+    """
+    Every rank (including rank 0) takes the next chunk index from a shared counter
+    living on rank 0 until all chunks are taken. No rank waits for a master to hand out work.
+
+    :return: chunk index -> result of `kernel` for the chunk
+    """
+    rank = comm.Get_rank()
+    itemsize = np.dtype(np.int64).itemsize
+    window = MPI.Win.Allocate(itemsize if rank == 0 else 0, itemsize, comm=comm)
+    if rank == 0:
+        # Allocated memory is not initialized
+        window.Lock(0)
+        window.Put(np.zeros(1, dtype=np.int64), 0)
+        window.Unlock(0)
+    comm.Barrier()
+
+    increment = np.ones(1, dtype=np.int64)
+    chunk_index = np.empty(1, dtype=np.int64)
+
+    computed = {}
+    while True:
+        window.Lock(0, MPI.LOCK_SHARED)
+        window.Fetch_and_op(increment, chunk_index, 0, 0, MPI.SUM)
+        window.Unlock(0)
+        i = int(chunk_index[0])
+        if i >= len(chunks):
+            break
+        lower, upper = chunks[i]
+        computed[i] = kernel(lower, upper, factors_B)
+
+    window.Free()
+    return computed
+
+
+def gather_interval_primes(comm, factors_B, computed_primes):
+    """
+    Gatherv of the per-rank intervals straight into one preallocated array on rank 0.
+    Intervals are ordered by rank, so the result is sorted without any extra work.
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
 
+    counts = np.zeros(size, dtype=np.int64)
+    comm.Gather(np.array([len(computed_primes)], dtype=np.int64), counts, root=0)
 
-def compute_primes(upper_bound: int):
+    if rank == 0:
+        primes = np.empty(len(factors_B) + counts.sum(), dtype=np.int64)
+        primes[:len(factors_B)] = factors_B
+        displacements = np.zeros(size, dtype=np.int64)
+        displacements[1:] = np.cumsum(counts)[:-1]
+        comm.Gatherv(computed_primes, [primes[len(factors_B):], counts, displacements, MPI.INT64_T], root=0)
+        return primes
+    comm.Gatherv(computed_primes, None, root=0)
+    return None
+
+
+def gather_chunk_primes(comm, factors_B, computed_primes: dict, n_chunks: int):
+    """
+    Collects chunks spread over the ranks in arbitrary order into one preallocated array on rank 0.
+    Each rank sends its chunks in a single message, which rank 0 receives with an indexed datatype
+    placing every chunk directly at its final offset - chunks are ordered, so the result is sorted.
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    # Row 0: prime count of every chunk, row 1: its owner
+    layout = np.zeros((2, n_chunks), dtype=np.int64)
+    for i, chunk_primes in computed_primes.items():
+        layout[0, i] = len(chunk_primes)
+        layout[1, i] = rank
+    total_layout = np.zeros_like(layout) if rank == 0 else None
+    comm.Reduce(layout, total_layout, op=MPI.SUM, root=0)
+
+    owned = sorted(computed_primes.keys())
+    if rank > 0:
+        send_buff = np.concatenate([computed_primes[i] for i in owned]) if len(owned) > 0 else np.empty(0, dtype=np.int64)
+        comm.Send(send_buff, dest=0)
+        return None
+
+    counts, owners = total_layout
+    offsets = len(factors_B) + np.concatenate(([0], np.cumsum(counts)[:-1]))
+    primes = np.empty(len(factors_B) + counts.sum(), dtype=np.int64)
+    primes[:len(factors_B)] = factors_B
+    for i in owned:
+        primes[offsets[i]:offsets[i] + counts[i]] = computed_primes[i]
+    for source in range(1, size):
+        source_chunks = np.flatnonzero(owners == source)
+        recv_type = MPI.INT64_T.Create_indexed(counts[source_chunks].tolist(), offsets[source_chunks].tolist()).Commit()
+        comm.Recv([primes, 1, recv_type], source=source)
+        recv_type.Free()
+    return primes
+
+
+def reduce_prime_stats(comm, factors_B, computed_stats: dict) -> tuple:
+    """
+    Only (count, sum) scalars of every rank go through the reduction, the primes never leave the ranks.
+    Sums are python ints, so they do not overflow for large upper bounds.
+    """
+    count = sum(stats[0] for stats in computed_stats.values())
+    total = sum(stats[1] for stats in computed_stats.values())
+    if comm.Get_rank() == 0:
+        count += len(factors_B)
+        total += int(factors_B.sum())
+    return comm.reduce(count, op=MPI.SUM, root=0), comm.reduce(total, op=MPI.SUM, root=0)
+
+
+KERNELS = {
+    'segmented': compute_primes_in_interval,
+    'wheel': compute_primes_in_interval_wheel,
+}
+
+
+def compute_primes(upper_bound: int, schedule: str, chunk_size: int, count_only: bool, with_sum: bool, kernel_name: str,
+                   output_dir: Optional[Path] = None, output_format: str = 'raw'):
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     size = comm.Get_size()
@@ -60,30 +260,100 @@ def compute_primes(upper_bound: int):
     # Set B was defined in task description
     limit_B = int(np.sqrt(upper_bound))
     factors_B = compute_primes_up_to(limit_B)
-    primes = np.copy(factors_B)
 
-    if rank == 0:
-        master(comm, size, limit_B, upper_bound)
-    else:
-        worker(comm, factors_B, 0)
+    reduce_only = count_only or with_sum
+    kernel = count_primes_in_interval if reduce_only else KERNELS[kernel_name]
 
-    if rank == 0:
-        # Point 4
-        for i in range(1, size):
-            received_primes = comm.recv(source=i)
-            primes = np.concatenate((primes, received_primes))
+    writer = None
+    if output_dir is not None and not reduce_only:
+        # Every rank streams its primes to its own file, only the block records are gathered
+        if rank == 0:
+            output_dir.mkdir(parents=True, exist_ok=True)
+        comm.Barrier()
+        writer = PrimeWriter(output_dir, rank, output_format)
+        interval_kernel = kernel
+
+        def kernel(lower, upper, factors):
+            return writer.write_interval(interval_kernel, lower, upper, factors)
+
+    if schedule == 'static':
+        if rank == 0:
+            master(comm, size, limit_B, upper_bound)
+            computed = {}
+        else:
+            computed = {rank - 1: worker(comm, factors_B, 0, kernel)}
+    else:
+        chunks = build_chunks(limit_B + 1, upper_bound, size, schedule, chunk_size)
+        computed = self_scheduled_worker(comm, chunks, factors_B, kernel)
 
-        n_primes = len(primes)
-        print(f'Found {n_primes} for upper bound: {upper_bound}')
-        # Sort copies the array
-        print(np.sort(primes))
+    # Point 4
+    if reduce_only:
+        n_primes, primes_sum = reduce_prime_stats(comm, factors_B, computed)
+        if rank == 0:
+            print(f'Found {n_primes} for upper bound: {upper_bound}')
+            if with_sum:
+                print(f'Sum of primes: {primes_sum}')
+    elif writer is not None:
+        records = list(computed.values())
+        if rank == 0:
+            records.append(writer.write(0, factors_B, 0))
+        writer.close()
+        gathered = comm.gather(records, root=0)
+        if rank == 0:
+            records = [record for rank_records in gathered for record in rank_records]
+            write_manifest(output_dir, output_format, upper_bound, records)
+            n_primes = sum(record['count'] for record in records)
+            print(f'Found {n_primes} for upper bound: {upper_bound}')
+            print(f'Written to: {output_dir}')
+    else:
+        if schedule == 'static':
+            interval_primes = computed[rank - 1] if rank > 0 else np.empty(0, dtype=np.int64)
+            primes = gather_interval_primes(comm, factors_B, interval_primes)
+        else:
+            primes = gather_chunk_primes(comm, factors_B, computed, len(chunks))
+        if rank == 0:
+            n_primes = len(primes)
+            print(f'Found {n_primes} for upper bound: {upper_bound}')
+            # Already sorted, intervals are ordered
+            print(primes)
 
     MPI.Finalize()
 
 
+def build_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="sieve")
+    parser.add_argument('upper_bound', type=int, help='Primes are computed up to this number (inclusive)')
+    parser.add_argument('--schedule', type=str, default='static', choices=['static', 'dynamic', 'guided'], dest='schedule',
+                        help='static - one interval per worker, rank 0 only distributes work; '
+                        'dynamic / guided - all ranks pull chunks on demand')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, dest='chunk_size', help='Chunk length for dynamic schedule, minimal chunk length for guided schedule')
+    parser.add_argument('--kernel', type=str, default='segmented', choices=list(KERNELS.keys()), dest='kernel_name',
+                        help='Interval kernel used when primes are gathered, counting modes always use the wheel')
+    parser.add_argument('--count-only', action='store_true', dest='count_only', help='Only count the primes, the primes are never sent between ranks')
+    parser.add_argument('--sum', action='store_true', dest='with_sum', help='Like --count-only, but also reports the sum of the primes')
+    parser.add_argument('--output', type=Path, default=None, dest='output_dir',
+                        help='Directory every rank streams its primes to (one file per rank plus manifest.json), instead of printing them from rank 0')
+    parser.add_argument('--output-format', type=str, default='raw', choices=FORMATS, dest='output_format',
+                        help='raw - little endian int64, varint - LEB128 varints of the gaps between primes')
+    return parser
+
+
+@dataclass
+class Args:
+    upper_bound: int
+    schedule: str
+    chunk_size: int
+    count_only: bool
+    with_sum: bool
+    kernel_name: str
+    output_dir: Optional[Path]
+    output_format: str
+
+
 def main():
-    upper_bound = int(sys.argv[1])
-    compute_primes(upper_bound)
+    args: Args = build_cli().parse_args()
+    compute_primes(args.upper_bound, args.schedule, args.chunk_size, args.count_only, args.with_sum, args.kernel_name,
+                   args.output_dir, args.output_format)
 
 
 if __name__ == "__main__":
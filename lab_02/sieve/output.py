@@ -0,0 +1,116 @@
+import json
+import numpy as np
+from pathlib import Path
+
+
+MANIFEST_FILE = 'manifest.json'
+FORMATS = ['raw', 'varint']
+# Numbers sieved and written at once, bounds memory used by the writer regardless of the prime count
+STREAM_BLOCK = 1 << 20
+
+
+def encode_varint_deltas(primes: np.ndarray, previous: int) -> np.ndarray:
+    """
+    LEB128 varints of the gaps between consecutive primes, the first gap is taken from `previous`.
+    Gaps are small, so almost every prime takes one or two bytes instead of eight.
+    """
+    deltas = np.diff(primes, prepend=previous).astype(np.uint64)
+    n_bytes = np.ones(len(deltas), dtype=np.int64)
+    rest = deltas >> np.uint64(7)
+    while np.any(rest > 0):
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+
+    ends = np.cumsum(n_bytes)
+    starts = ends - n_bytes
+    encoded = np.empty(ends[-1] if len(ends) > 0 else 0, dtype=np.uint8)
+    for i in range(int(n_bytes.max()) if len(n_bytes) > 0 else 0):
+        has_byte = n_bytes > i
+        group = (deltas[has_byte] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        continuation = np.where(n_bytes[has_byte] > i + 1, 0x80, 0).astype(np.uint64)
+        encoded[starts[has_byte] + i] = (group | continuation).astype(np.uint8)
+    return encoded
+
+
+def decode_varint_deltas(encoded: np.ndarray, previous: int) -> np.ndarray:
+    if len(encoded) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero((encoded & 0x80) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    value_of_byte = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 7 * (np.arange(len(encoded)) - starts[value_of_byte])
+    groups = (encoded & 0x7F).astype(np.int64) << shifts
+    return previous + np.cumsum(np.add.reduceat(groups, starts))
+
+
+class PrimeWriter:
+    """
+    Streams primes of one rank into its own file, block after block, as they are sieved.
+    Every written interval is described by a record, which is all rank 0 ever gets to build the manifest.
+    """
+
+    def __init__(self, output_dir: Path, rank: int, output_format: str):
+        self.output_format = output_format
+        self.file_name = f'rank_{rank:05d}.bin'
+        self.file = open(output_dir.joinpath(self.file_name), 'wb')
+        self.offset = 0
+
+    def write(self, lower: int, primes: np.ndarray, previous: int) -> dict:
+        if self.output_format == 'varint':
+            encoded = encode_varint_deltas(primes, previous)
+        else:
+            encoded = primes.astype('<i8', copy=False)
+        self.file.write(encoded.tobytes())
+        record = {'file': self.file_name, 'lower': lower, 'offset': self.offset, 'length': encoded.nbytes,
+                  'count': len(primes), 'previous': previous}
+        self.offset += encoded.nbytes
+        return record
+
+    def write_interval(self, kernel, lower: int, upper: int, factors) -> dict:
+        """
+        Sieves [lower, upper] with `kernel` in blocks of `STREAM_BLOCK` numbers and appends them to the file.
+        The whole interval is described by one record.
+        """
+        record = {'file': self.file_name, 'lower': lower, 'offset': self.offset, 'length': 0, 'count': 0, 'previous': lower}
+        previous = lower
+        for block_lower in range(lower, upper + 1, STREAM_BLOCK):
+            primes = kernel(block_lower, min(block_lower + STREAM_BLOCK - 1, upper), factors)
+            block_record = self.write(block_lower, primes, previous)
+            record['length'] += block_record['length']
+            record['count'] += block_record['count']
+            if len(primes) > 0:
+                previous = int(primes[-1])
+        return record
+
+    def close(self):
+        self.file.close()
+
+
+def write_manifest(output_dir: Path, output_format: str, upper_bound: int, records: list):
+    records = sorted(records, key=lambda record: record['lower'])
+    manifest = {
+        'format': output_format,
+        'upper_bound': upper_bound,
+        'count': sum(record['count'] for record in records),
+        'blocks': records,
+    }
+    with open(output_dir.joinpath(MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+
+def iter_output(output_dir: Path):
+    """
+    Lazily yields the primes written by `PrimeWriter`s, block by block, in increasing order.
+    """
+    with open(output_dir.joinpath(MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    for record in manifest['blocks']:
+        if record['length'] == 0:
+            continue
+        with open(output_dir.joinpath(record['file']), 'rb') as block_file:
+            block_file.seek(record['offset'])
+            data = block_file.read(record['length'])
+        if manifest['format'] == 'varint':
+            yield decode_varint_deltas(np.frombuffer(data, dtype=np.uint8), record['previous'])
+        else:
+            yield np.frombuffer(data, dtype='<i8')
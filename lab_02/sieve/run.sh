@@ -11,3 +11,4 @@ module load scipy-bundle/2021.10-intel-2021b
 export SLURM_OVERLAP=1
 mpiexec ./main.py 2048
 
+# mpiexec ./main.py 2048 --schedule guided --chunk-size 65536
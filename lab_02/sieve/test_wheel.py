@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from main import KERNELS, compute_primes_up_to, compute_primes_up_to_dense, count_primes_in_interval
+
+
+# Below 25 the primes up to sqrt(upper_bound) lack some of the wheel primes
+UPPER_BOUNDS = list(range(2, 100)) + [1000, 12345]
+
+
+@pytest.mark.parametrize('upper_bound', UPPER_BOUNDS)
+@pytest.mark.parametrize('kernel_name', list(KERNELS))
+def test_kernel_matches_dense(kernel_name, upper_bound):
+    limit_B = int(np.sqrt(upper_bound))
+    factors_B = compute_primes_up_to(limit_B)
+    primes = np.concatenate((factors_B, KERNELS[kernel_name](limit_B + 1, upper_bound, factors_B)))
+    np.testing.assert_array_equal(primes, compute_primes_up_to_dense(upper_bound))
+
+
+@pytest.mark.parametrize('upper_bound', UPPER_BOUNDS)
+def test_count_matches_dense(upper_bound):
+    limit_B = int(np.sqrt(upper_bound))
+    factors_B = compute_primes_up_to(limit_B)
+    count, total = count_primes_in_interval(limit_B + 1, upper_bound, factors_B)
+    expected = compute_primes_up_to_dense(upper_bound)
+    assert (len(factors_B) + count, int(factors_B.sum()) + total) == (len(expected), int(expected.sum()))
+
+
+@pytest.mark.parametrize('upper_bound', UPPER_BOUNDS)
+def test_chunked_count_matches_dense(upper_bound):
+    # Chunks of the dynamic schedule start anywhere, also below the wheel primes
+    factors_B = compute_primes_up_to(int(np.sqrt(upper_bound)))
+    stats = [count_primes_in_interval(lower, min(lower + 6, upper_bound), factors_B) for lower in range(int(np.sqrt(upper_bound)) + 1, upper_bound + 1, 7)]
+    expected = compute_primes_up_to_dense(upper_bound)
+    assert len(factors_B) + sum(s[0] for s in stats) == len(expected)
+    assert int(factors_B.sum()) + sum(s[1] for s in stats) == int(expected.sum())
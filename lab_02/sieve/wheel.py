@@ -0,0 +1,115 @@
+import numpy as np
+from dataclasses import dataclass
+
+
+# 2/3/5 wheel: only numbers coprime with 30 are stored, one bit per such residue,
+# so a single byte covers 30 consecutive integers.
+WHEEL = 30
+RESIDUES = np.array([1, 7, 11, 13, 17, 19, 23, 29], dtype=np.int64)
+# Primes of the wheel itself, none of them is ever stored
+WHEEL_PRIMES = np.array([2, 3, 5], dtype=np.int64)
+# Multiplicative inverses of the residues modulo WHEEL
+INVERSES = {int(r): pow(int(r), -1, WHEEL) for r in RESIDUES}
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# Bytes sieved at once, 256 KiB fits in L2 and covers ~7.8M integers
+SEGMENT_BYTES = 1 << 18
+# Primes with at most that many multiples in a segment are crossed off all at once with fancy indexing,
+# smaller ones one by one with strided slices
+MAX_SCATTER_HITS = 16
+
+
+@dataclass
+class WheelSieve:
+    """
+    Bit k of `bits[j]` is set iff `base + WHEEL * j + RESIDUES[k]` survived the sieve.
+    """
+    base: int
+    bits: np.ndarray
+
+    def count(self) -> int:
+        return int(POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def iter_primes(self, block_bytes: int = SEGMENT_BYTES):
+        """
+        Lazily yields sorted arrays of the surviving numbers, `block_bytes` bytes of the mask at a time.
+        """
+        for start in range(0, len(self.bits), block_bytes):
+            block = self.bits[start:start + block_bytes]
+            survived = np.unpackbits(block, bitorder='little').reshape(-1, len(RESIDUES))
+            j, k = np.nonzero(survived)
+            yield self.base + WHEEL * (start + j.astype(np.int64)) + RESIDUES[k]
+
+    def to_array(self) -> np.ndarray:
+        blocks = list(self.iter_primes())
+        if len(blocks) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(blocks)
+
+
+def _clear_out_of_bounds(sieve: WheelSieve, lower: int, upper: int):
+    for j in {0, len(sieve.bits) - 1}:
+        numbers = sieve.base + WHEEL * j + RESIDUES
+        out_of_bounds = (numbers < lower) | (numbers > upper)
+        sieve.bits[j] &= ~np.packbits(out_of_bounds, bitorder='little')[0]
+
+
+def missing_wheel_primes(lower: int, upper: int, factors: list) -> np.ndarray:
+    """
+    :return: wheel primes from [lower, upper] that are not among `factors`. The primes up to sqrt(upper)
+        lack 5 for upper < 25 and 3 for upper < 9, the wheel sieve alone would drop these primes.
+    """
+    in_interval = (WHEEL_PRIMES >= lower) & (WHEEL_PRIMES <= upper)
+    return WHEEL_PRIMES[in_interval & ~np.isin(WHEEL_PRIMES, factors)]
+
+
+def iter_wheel_segments(lower: int, upper: int, factors: list, segment_bytes: int = SEGMENT_BYTES):
+    """
+    Yields `WheelSieve`s of consecutive segments of [lower, upper] with multiples of `factors` crossed off.
+    Multiples of 2, 3 and 5 are never stored, so the numbers surviving `compute_primes_in_interval`
+    are the ones surviving here plus `missing_wheel_primes`.
+    """
+    factors = np.asarray(factors, dtype=np.int64)
+    factors = factors[WHEEL % factors != 0]
+    # Residue (mod WHEEL) of the cofactor q such that p * q hits RESIDUES[k], for every factor p
+    cofactor_residues = np.array([[(int(r) * INVERSES[int(p) % WHEEL]) % WHEEL for p in factors] for r in RESIDUES], dtype=np.int64).reshape(len(RESIDUES), -1)
+
+    first_base = (lower // WHEEL) * WHEEL
+    n_bytes = max(0, (upper - first_base) // WHEEL + 1)
+    for start in range(0, n_bytes, segment_bytes):
+        segment_base = first_base + WHEEL * start
+        n_segment_bytes = min(segment_bytes, n_bytes - start)
+        bits = np.full(n_segment_bytes, 0xFF, dtype=np.uint8)
+
+        n_sliced = np.searchsorted(factors, n_segment_bytes // MAX_SCATTER_HITS)
+        min_cofactors = np.maximum(-(-segment_base // factors), 1)
+        for k in range(len(RESIDUES)):
+            bit = np.uint8(~(1 << k) & 0xFF)
+            cofactors = min_cofactors + (cofactor_residues[k] - min_cofactors) % WHEEL
+            first_hits = (factors * cofactors - segment_base) // WHEEL
+            for p, j in zip(factors[:n_sliced], first_hits[:n_sliced]):
+                bits[j::p] &= bit
+            # Larger factors hit the segment only a few times
+            hits, strides = first_hits[n_sliced:], factors[n_sliced:]
+            in_segment = hits < n_segment_bytes
+            hits, strides = hits[in_segment], strides[in_segment]
+            while len(hits) > 0:
+                # Duplicated indices all clear the same bit, so the fancy assignment is safe
+                bits[hits] &= bit
+                hits = hits + strides
+                in_segment = hits < n_segment_bytes
+                hits, strides = hits[in_segment], strides[in_segment]
+
+        sieve = WheelSieve(segment_base, bits)
+        _clear_out_of_bounds(sieve, lower, upper)
+        yield sieve
+
+
+def sieve_interval_wheel(lower: int, upper: int, factors: list, segment_bytes: int = SEGMENT_BYTES) -> WheelSieve:
+    """
+    Bit-packed wheel sieve of the whole [lower, upper]: one byte per 30 integers,
+    instead of a bool and an int64 per integer.
+    """
+    segments = list(iter_wheel_segments(lower, upper, factors, segment_bytes))
+    if len(segments) == 0:
+        return WheelSieve((lower // WHEEL) * WHEEL, np.empty(0, dtype=np.uint8))
+    return WheelSieve(segments[0].base, np.concatenate([segment.bits for segment in segments]))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import argparse
+import tracemalloc
+import numpy as np
+from mpi4py import MPI
+from timeit import default_timer as timer
+from dataclasses import dataclass
+from main import JacobiSolver, vsize_for_rank
+
+
+def build_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="solver-bench")
+    parser.add_argument('--grid-points', type=int, nargs='+', default=[1024, 2048, 4096], dest='grid_points', help='Problem sizes to benchmark')
+    parser.add_argument('-a', '--side', type=float, default=8192, dest='a', help='Side length of the membrane')
+    parser.add_argument('--theta', type=float, default=256, dest='theta', help='Right side of the equation')
+    parser.add_argument('--iters', type=int, default=64, dest='iters', help='Number of iterations in iterative method')
+    return parser
+
+
+@dataclass
+class Args:
+    grid_points: list
+    a: float
+    theta: float
+    iters: int
+
+
+def reference_iterations(comm, rank, size, delta, grid_points, theta, iters):
+    """
+    Original `compute()` loop, yielding the stripe after every iteration.
+    The original drops the send requests, so once the rows no longer fit in an eager message the copies
+    may be freed before the neighbour receives them. Here the requests are kept and waited for before returning
+    (except the last iteration's, nobody receives those), otherwise the reference itself is wrong.
+    """
+    hsize = grid_points
+    vsize = vsize_for_rank(rank, size, grid_points)
+    H = np.zeros((vsize, hsize), dtype=np.float64)
+    recv_buff = np.empty(hsize, dtype=np.float64)
+
+    x_min = 0 if rank > 0 else 1
+    x_max = vsize if rank < size - 1 else vsize - 1
+    send_requests = []
+
+    for i in range(iters):
+        H_i = np.zeros((vsize, hsize), dtype=np.float64)
+        if i > 0:
+            if rank > 0:
+                comm.Recv(recv_buff, rank - 1, i - 1)
+                H_i[0] += recv_buff
+            if rank < size - 1:
+                comm.Recv(recv_buff, rank + 1, i - 1)
+                H_i[-1] += recv_buff
+
+        H_i[x_min : x_max, 1 : hsize - 1] -= delta ** 2 * theta
+        H_i[x_min : x_max, 1 : hsize - 1] += H[x_min : x_max, 0 : hsize - 2]
+        H_i[x_min : x_max, 1 : hsize - 1] += H[x_min : x_max, 2 : hsize]
+        H_i[1 : x_max, :] += H[0 : x_max - 1, :]
+        H_i[x_min : vsize - 1, :] += H[x_min + 1 : vsize, :]
+
+        H_i /= 4
+        H = H_i
+
+        if rank > 0:
+            send_requests.append(comm.Isend(H[0].copy(), rank - 1, i))
+        if rank < size - 1:
+            send_requests.append(comm.Isend(H[-1].copy(), rank + 1, i))
+        yield H
+    last_iteration_sends = (rank > 0) + (rank < size - 1)
+    MPI.Request.Waitall(send_requests[:len(send_requests) - last_iteration_sends])
+
+
+def solver_iterations(comm, rank, size, delta, grid_points, theta, iters, overlap=False):
+    solver = JacobiSolver(comm, rank, size, delta, grid_points, theta, overlap)
+    for i in range(iters):
+        solver.step(i)
+        yield solver.stripe()
+    solver.close()
+
+
+def overlapped_solver_iterations(comm, rank, size, delta, grid_points, theta, iters):
+    return solver_iterations(comm, rank, size, delta, grid_points, theta, iters, overlap=True)
+
+
+IMPLEMENTATIONS = {
+    'reference': reference_iterations,
+    'double_buffered': solver_iterations,
+    'overlapped': overlapped_solver_iterations,
+}
+
+
+def measure(iterations):
+    """
+    :return: (time per iteration [ms], bytes allocated per iteration, last stripe).
+        Allocated bytes are the peak of memory traced during an iteration above the memory traced before it.
+    """
+    allocated = []
+    elapsed = 0
+    stripe = None
+    tracemalloc.start()
+    while True:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        start_time = timer()
+        try:
+            stripe = next(iterations)
+        except StopIteration:
+            break
+        elapsed += timer() - start_time
+        _, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - before)
+    tracemalloc.stop()
+    # Median skips one-off setup done in the first iteration
+    return elapsed * 1000 / len(allocated), int(np.median(allocated)), stripe
+
+
+def main():
+    args: Args = build_cli().parse_args()
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    if rank == 0:
+        print('impl,process_count,problem_size,iters,time_per_iter,allocated_bytes_per_iter,allocated_grids_per_iter')
+    for grid_points in args.grid_points:
+        delta = args.a / (grid_points - 1)
+        grid_bytes = vsize_for_rank(rank, size, grid_points) * grid_points * np.dtype(np.float64).itemsize
+        stripes = {}
+        for impl, iterations in IMPLEMENTATIONS.items():
+            # Separate communicator, so that unreceived messages of one implementation never reach the other
+            impl_comm = comm.Dup()
+            impl_comm.Barrier()
+            time_per_iter, allocated, stripe = measure(iterations(impl_comm, rank, size, delta, grid_points, args.theta, args.iters))
+            stripes[impl] = stripe.copy()
+            time_per_iter = comm.reduce(time_per_iter, op=MPI.MAX, root=0)
+            allocated = comm.reduce(allocated, op=MPI.MAX, root=0)
+            if rank == 0:
+                print(f'{impl},{size},{grid_points},{args.iters},{time_per_iter},{allocated},{allocated / grid_bytes:.3f}')
+
+        # With single-row stripes the first and last rank of the original add the halo into the fixed boundary row
+        if vsize_for_rank(size - 1, size, grid_points) > 1:
+            for impl, stripe in stripes.items():
+                identical = comm.allreduce(np.array_equal(stripes['reference'], stripe), op=MPI.LAND)
+                assert identical, f'Results of {impl} differ for problem size {grid_points}'
+
+
+if __name__ == "__main__":
+    main()
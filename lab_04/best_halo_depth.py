@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import argparse
+from pathlib import Path
+from dataclasses import dataclass
+from polars import col, Config, read_csv
+
+COL_HALO_DEPTH = 'halo_depth'
+COL_PROCESS_COUNT = 'process_count'
+COL_PROBLEM_SIZE = 'problem_size'
+COL_TIME = 'time'
+COL_TIME_AVG = COL_TIME + '_avg'
+COL_TIME_STD = COL_TIME + '_std'
+COL_SPEEDUP = 'speedup'
+
+
+@dataclass
+class Args:
+    input_file: Path
+
+
+def build_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input-file', type=Path, required=True, dest='input_file', help='Path to output of halo_sweep.sh')
+    return parser
+
+
+def main():
+    args: Args = build_cli().parse_args()
+    Config.set_tbl_rows(100)
+
+    # halo_depth,process_count,problem_size,series_id,time,iterations,residual
+    df_per_depth = (
+        read_csv(args.input_file, has_header=True).lazy()
+        .group_by([col(COL_PROCESS_COUNT), col(COL_PROBLEM_SIZE), col(COL_HALO_DEPTH)])
+        .agg([
+            col(COL_TIME).mean().alias(COL_TIME_AVG),
+            col(COL_TIME).std().alias(COL_TIME_STD),
+        ])
+    )
+    df_baseline = df_per_depth.filter(col(COL_HALO_DEPTH) == 1).select([col(COL_PROCESS_COUNT), col(COL_PROBLEM_SIZE), col(COL_TIME_AVG).alias(COL_TIME)])
+    df_best = (
+        df_per_depth
+        .sort(col(COL_TIME_AVG))
+        .group_by([col(COL_PROCESS_COUNT), col(COL_PROBLEM_SIZE)])
+        .first()
+        .join(df_baseline, on=[COL_PROCESS_COUNT, COL_PROBLEM_SIZE], how='left')
+        # Speedup over exchanging a single row every iteration
+        .with_columns([(col(COL_TIME) / col(COL_TIME_AVG)).alias(COL_SPEEDUP)])
+        .drop(COL_TIME)
+        .sort([col(COL_PROBLEM_SIZE), col(COL_PROCESS_COUNT)])
+        .collect()
+    )
+    print(df_best)
+    df_best.write_csv(args.input_file.parent.joinpath(args.input_file.stem + '_best_halo_depth').with_suffix('.csv'))
+
+
+if __name__ == "__main__":
+    main()
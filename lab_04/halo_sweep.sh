@@ -0,0 +1,51 @@
+#!/bin/bash -l
+#SBATCH --account=plgar2023-cpu
+#SBATCH --time=06:00:00
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --partition=plgrid
+#SBATCH --cpus-per-task=16
+#SBATCH --mem-per-cpu=512M
+
+# Same runs as run.sh, repeated for every halo depth (temporal blocking).
+# Best depth per (process count, problem size): ./best_halo_depth.py -i <output csv>
+
+module purge
+module load scipy-bundle/2021.10-intel-2021b
+
+problem_sizes=(1024 2048 4096)
+halo_depths=(1 2 4 8 16)
+side_length=8192
+cpu_min_count=1
+cpu_max_count=16
+series_count=5
+theta=256
+iters=64
+csv_header="halo_depth,process_count,problem_size,series_id,time,iterations,residual,kernel,dtype,error,points_per_rank,columns,throughput,stencil_min,stencil_mean,stencil_max,halo_wait_min,halo_wait_mean,halo_wait_max,send_min,send_mean,send_max,reduce_min,reduce_mean,reduce_max,gather_min,gather_mean,gather_max,io_min,io_mean,io_max,other_min,other_mean,other_max"
+output_dir="${SCRATCH}/ar"
+output_file_base="${output_dir}/halo_$(date +%Y%m%dT%H%M%S)"
+output_file="${output_file_base}.csv"
+
+mkdir -p $output_dir
+echo $csv_header > $output_file
+
+total_task=$(( "${#problem_sizes[@]}" * "${#halo_depths[@]}" * (cpu_max_count - cpu_min_count + 1) * series_count ))
+completed_task=0
+
+for (( n_cpu = $cpu_min_count ; n_cpu <= $cpu_max_count ; n_cpu++ )); do
+  for problem_size in "${problem_sizes[@]}"; do
+    for halo_depth in "${halo_depths[@]}"; do
+      for (( series_id = 0 ; series_id < $series_count ; series_id++ )); do
+        # Ghost rows have to come from the neighbouring stripe only
+        if (( halo_depth <= problem_size / n_cpu )); then
+          echo "[$(date +%Y%m%dT%H%M%S)] Run: mpiexec -np $n_cpu ./main.py --series $series_id --side $side_length --theta $theta --iters $iters --grid-points $problem_size --halo-depth $halo_depth >> $output_file"
+          mpiexec -np $n_cpu ./main.py --series $series_id --side $side_length --theta $theta --iters $iters --grid-points $problem_size --halo-depth $halo_depth | sed "s/^/${halo_depth},/" >> $output_file
+        fi
+        completed_task=$(( $completed_task + 1 ))
+        echo "[$(date +%Y%m%dT%H%M%S)] Completion: $completed_task / $total_task"
+      done
+    done
+  done
+done
+
+zip -q "${output_file_base}.zip" $output_file
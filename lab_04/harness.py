@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shlex
+import hashlib
+import argparse
+import subprocess
+import mpi4py
+import numpy as np
+from scipy import stats
+from datetime import datetime
+from pathlib import Path
+from timeit import default_timer as timer
+from dataclasses import dataclass
+from typing import Optional
+
+# The runs are launched by mpiexec, an MPI initialized here would be inherited by them
+mpi4py.rc.initialize = False
+from main import CSV_HEADER
+
+
+SOLVER = Path(__file__).resolve().parent.joinpath('main.py')
+SIEVE = Path(__file__).resolve().parent.parent.joinpath('lab_02', 'sieve', 'main.py')
+# Hash of the options of the target, the last column of the results store
+CONFIG_COLUMN = 'config'
+# Columns of the results store of every target, the first two and the config identify the configuration
+HEADERS = {
+    'solver': f'{CSV_HEADER},{CONFIG_COLUMN}',
+    'sieve': f'process_count,upper_bound,series_id,time,{CONFIG_COLUMN}',
+}
+DEFAULT_SIZES = {
+    'solver': [1024, 2048, 4096],
+    'sieve': [10 ** 8, 10 ** 9],
+}
+TIME_COLUMN = 3
+
+
+def build_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="harness")
+    parser.add_argument('target', type=str, choices=list(HEADERS), help='solver - lab_04/main.py, sieve - lab_02/sieve/main.py')
+    parser.add_argument('--store', type=Path, required=True, dest='store',
+                        help='CSV file the runs are appended to, runs already in it are not repeated')
+    parser.add_argument('--sizes', type=int, nargs='+', default=None, dest='sizes',
+                        help='Grid points of the solver or upper bounds of the sieve, 1024 2048 4096 and 10^8 10^9 by default')
+    parser.add_argument('--process-counts', type=int, nargs='+', default=None, dest='process_counts',
+                        help='Ranks to run every size on, every count from 1 to the number of usable cores by default')
+    parser.add_argument('--warmup-runs', type=int, default=1, dest='warmup_runs', help='Runs of every configuration that are not stored')
+    parser.add_argument('--min-runs', type=int, default=5, dest='min_runs', help='Runs of every configuration before the stopping rule applies')
+    parser.add_argument('--max-runs', type=int, default=30, dest='max_runs', help='Runs of every configuration at most')
+    parser.add_argument('--confidence', type=float, default=0.95, dest='confidence', help='Confidence level of the interval of the mean time')
+    parser.add_argument('--precision', type=float, default=0.02, dest='precision',
+                        help='Configuration is done once the half-width of the confidence interval is at most this fraction of the mean')
+    parser.add_argument('--mpiexec', type=str, default='mpiexec', dest='mpiexec', help='Launcher command, with its own options')
+    parser.add_argument('--bind-to', type=str, default='core', dest='bind_to', help='Binding of the ranks passed to the launcher, none disables it')
+    parser.add_argument('--target-args', type=str, default='', dest='target_args',
+                        help='Further options of the target, e.g. "--kernel numpy" (the solver gets --side 8192 --theta 256 --iters 64 unless given, '
+                        'the sieve runs with --count-only --schedule dynamic). Runs with other options are another configuration in the store')
+    return parser
+
+
+@dataclass
+class Args:
+    target: str
+    store: Path
+    sizes: Optional[list]
+    process_counts: Optional[list]
+    warmup_runs: int
+    min_runs: int
+    max_runs: int
+    confidence: float
+    precision: float
+    mpiexec: str
+    bind_to: str
+    target_args: str
+
+
+def launcher(args: Args, process_count) -> list:
+    command = shlex.split(args.mpiexec) + ['-np', str(process_count)]
+    if args.bind_to != 'none':
+        command += ['--map-by', args.bind_to, '--bind-to', args.bind_to]
+    return command
+
+
+def target_options(args: Args) -> list:
+    """
+    :return: options every run of the target gets, with the defaults of the harness filled in
+    """
+    target_args = shlex.split(args.target_args)
+    if args.target == 'sieve':
+        # Static schedule needs a master and at least one worker, with the dynamic one every rank sieves
+        return ['--count-only', '--schedule', 'dynamic'] + target_args
+    # Options with a default come first in a fixed order, so that giving the default changes nothing
+    options = []
+    for option, value in [('--side', '8192'), ('--theta', '256'), ('--iters', '64')]:
+        if option in target_args:
+            i = target_args.index(option)
+            value = target_args[i + 1]
+            del target_args[i:i + 2]
+        options += [option, value]
+    return options + target_args
+
+
+def config_id(args: Args) -> str:
+    """
+    :return: hash of the options of the target, runs with other options are another configuration
+    """
+    return hashlib.sha1(shlex.join(target_options(args)).encode()).hexdigest()[:12]
+
+
+def run_solver(args: Args, process_count, grid_points, series) -> str:
+    """
+    :return: CSV row the solver printed, timed by the solver itself (without the startup)
+    """
+    command = (launcher(args, process_count) + [sys.executable, str(SOLVER), '--series', str(series), '--grid-points', str(grid_points)]
+               + target_options(args))
+    result = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def run_sieve(args: Args, process_count, upper_bound, series) -> str:
+    """
+    :return: CSV row of the run, the sieve does not time itself, so the whole launch is timed
+    """
+    command = launcher(args, process_count) + [sys.executable, str(SIEVE), str(upper_bound)] + target_options(args)
+    start_time = timer()
+    subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
+    elapsed = timer() - start_time
+    return f'{process_count},{upper_bound},{series},{elapsed * 1000}'
+
+
+RUNS = {
+    'solver': run_solver,
+    'sieve': run_sieve,
+}
+
+
+class ResultStore:
+    """
+    Append-only CSV file of the runs. Every row is written and synced as soon as its run ends,
+    so a killed job loses the run in progress only. A row cut off by the kill is skipped when the file is read.
+    A store of an older header is migrated to the current one, see `migrate`.
+    """
+
+    def __init__(self, path: Path, header: str):
+        self.path = path
+        self.header = header
+        # Times of the runs by (process count, size, config)
+        self.times = {}
+        if path.exists():
+            with open(path) as store_file:
+                lines = store_file.read().split('\n')
+            if lines[0] != header:
+                lines = self.migrate(lines)
+            n_columns = len(header.split(','))
+            for line in lines[1:]:
+                values = line.split(',')
+                if len(values) != n_columns:
+                    continue
+                self.times.setdefault(self.key(values), []).append(float(values[TIME_COLUMN]))
+            complete = lines[-1] == ''
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w') as store_file:
+                store_file.write(header + '\n')
+            complete = True
+        self.file = open(path, 'a')
+        if not complete:
+            # Next row must not be glued to the cut off one
+            self.file.write('\n')
+
+    def migrate(self, lines) -> list:
+        """
+        Rewrites a store written with an older header (e.g. before columns were added to the solver's CSV)
+        into the columns of `header`, the columns it lacks are left empty. Cut off rows are dropped.
+
+        :return: lines of the migrated file
+        """
+        old_columns = lines[0].split(',')
+        columns = self.header.split(',')
+        if not set(old_columns) <= set(columns) or not set(columns[:TIME_COLUMN + 1]) <= set(old_columns):
+            raise ValueError(f'{self.path} has columns {lines[0]}, expected {self.header} or a part of it')
+        rows = [dict(zip(old_columns, line.split(','))) for line in lines[1:] if len(line.split(',')) == len(old_columns)]
+        migrated = [self.header] + [','.join(row.get(column, '') for column in columns) for row in rows] + ['']
+        # Store is either the old or the migrated one, whenever the job is killed.
+        # Runs of a store without the config column are not attributed to any configuration
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text('\n'.join(migrated))
+        os.replace(tmp_path, self.path)
+        return migrated
+
+    def append(self, row: str):
+        self.file.write(row + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        values = row.split(',')
+        self.times.setdefault(self.key(values), []).append(float(values[TIME_COLUMN]))
+
+    @staticmethod
+    def key(values) -> tuple:
+        """
+        :return: (process count, size, config) of a row
+        """
+        return int(values[0]), int(values[1]), values[-1]
+
+    def close(self):
+        self.file.close()
+
+
+def confidence_half_width(times, confidence) -> float:
+    """
+    :return: half-width of the Student's t confidence interval of the mean of `times`
+    """
+    n = len(times)
+    if n < 2:
+        return float('inf')
+    return stats.t.ppf((1 + confidence) / 2, n - 1) * np.std(times, ddof=1) / np.sqrt(n)
+
+
+def is_done(times, args: Args) -> bool:
+    if len(times) >= args.max_runs:
+        return True
+    return len(times) >= args.min_runs and confidence_half_width(times, args.confidence) <= args.precision * np.mean(times)
+
+
+def log(message):
+    print(f'[{datetime.now():%Y%m%dT%H%M%S}] {message}', flush=True)
+
+
+def main():
+    parser = build_cli()
+    args: Args = parser.parse_args()
+    if not 2 <= args.min_runs <= args.max_runs:
+        parser.error('--min-runs must be at least 2 and at most --max-runs')
+    sizes = args.sizes or DEFAULT_SIZES[args.target]
+    process_counts = args.process_counts or list(range(1, len(os.sched_getaffinity(0)) + 1))
+    run = RUNS[args.target]
+    config = config_id(args)
+    log(f'Config {config}: {shlex.join(target_options(args))}')
+
+    store = ResultStore(args.store, HEADERS[args.target])
+    for process_count in process_counts:
+        for size in sizes:
+            times = store.times.get((process_count, size, config), [])
+            if is_done(times, args):
+                continue
+            if len(times) > 0:
+                log(f'Resume: {process_count} processes, size {size} after {len(times)} runs')
+            for _ in range(args.warmup_runs):
+                run(args, process_count, size, -1)
+            while not is_done(times, args):
+                store.append(f'{run(args, process_count, size, len(times))},{config}')
+                times = store.times[(process_count, size, config)]
+            half_width = confidence_half_width(times, args.confidence)
+            log(f'Done: {process_count} processes, size {size}, {len(times)} runs, '
+                f'mean {np.mean(times):.3f} ms +- {half_width:.3f} ms ({half_width / np.mean(times) * 100:.1f}%)')
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
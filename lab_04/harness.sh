@@ -0,0 +1,22 @@
+#!/bin/bash -l
+#SBATCH --account=plgar2023-cpu
+#SBATCH --time=02:00:00
+#SBATCH --nodes=1
+#SBATCH --ntasks=16
+#SBATCH --partition=plgrid
+#SBATCH --cpus-per-task=1
+#SBATCH --mem-per-cpu=512M
+
+module purge
+module load scipy-bundle/2021.10-intel-2021b
+# module add .plgrid plgrid/tools/openmpi
+
+# Stores are not timestamped, a job resubmitted after a timeout continues where the previous one stopped
+output_dir="${SCRATCH}/ar"
+solver_store="${output_dir}/harness_solver.csv"
+sieve_store="${output_dir}/harness_sieve.csv"
+
+mkdir -p $output_dir
+
+./harness.py solver --store $solver_store --sizes 1024 2048 4096 --target-args "--side 8192 --theta 256 --iters 64"
+./harness.py sieve --store $sieve_store --sizes 100000000 1000000000
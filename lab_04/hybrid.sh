@@ -0,0 +1,52 @@
+#!/bin/bash -l
+#SBATCH --account=plgar2023-cpu
+#SBATCH --time=04:00:00
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --partition=plgrid
+#SBATCH --cpus-per-task=16
+#SBATCH --mem-per-cpu=512M
+
+# Same runs as run.sh on all 16 cores, split between ranks and threads of every rank (ranks x threads).
+# process_count is the number of ranks, cores used are threads_per_rank * process_count.
+
+module purge
+module load scipy-bundle/2021.10-intel-2021b
+
+problem_sizes=(1024 2048 4096)
+# ranks:threads
+configurations=(1:16 2:8 4:4 8:2 16:1)
+side_length=8192
+series_count=5
+theta=256
+iters=64
+csv_header="threads_per_rank,process_count,problem_size,series_id,time,iterations,residual,kernel,dtype,error,points_per_rank,columns,throughput,stencil_min,stencil_mean,stencil_max,halo_wait_min,halo_wait_mean,halo_wait_max,send_min,send_mean,send_max,reduce_min,reduce_mean,reduce_max,gather_min,gather_mean,gather_max,io_min,io_mean,io_max,other_min,other_mean,other_max"
+output_dir="${SCRATCH}/ar"
+output_file_base="${output_dir}/hybrid_$(date +%Y%m%dT%H%M%S)"
+output_file="${output_file_base}.csv"
+
+# NumPy ufuncs are single threaded anyway, keep BLAS from spawning threads of its own
+export OMP_NUM_THREADS=1
+export MKL_NUM_THREADS=1
+
+mkdir -p $output_dir
+echo $csv_header > $output_file
+
+total_task=$(( "${#problem_sizes[@]}" * "${#configurations[@]}" * series_count ))
+completed_task=0
+
+for configuration in "${configurations[@]}"; do
+  n_ranks=${configuration%:*}
+  n_threads=${configuration#*:}
+  for problem_size in "${problem_sizes[@]}"; do
+    for (( series_id = 0 ; series_id < $series_count ; series_id++ )); do
+      # Every rank gets its own set of cores, default binding would put all threads of a rank on one core
+      echo "[$(date +%Y%m%dT%H%M%S)] Run: mpiexec -np $n_ranks --map-by slot:PE=$n_threads ./main.py --series $series_id --side $side_length --theta $theta --iters $iters --grid-points $problem_size --threads-per-rank $n_threads >> $output_file"
+      mpiexec -np $n_ranks --map-by slot:PE=$n_threads ./main.py --series $series_id --side $side_length --theta $theta --iters $iters --grid-points $problem_size --threads-per-rank $n_threads | sed "s/^/${n_threads},/" >> $output_file
+      completed_task=$(( $completed_task + 1 ))
+      echo "[$(date +%Y%m%dT%H%M%S)] Completion: $completed_task / $total_task"
+    done
+  done
+done
+
+zip -q "${output_file_base}.zip" $output_file
@@ -1,29 +1,116 @@
 #!/usr/bin/env python
 
+import io
+import os
+import json
+import hashlib
+import shutil
+import threading
+import multiprocessing
 import numpy as np
 import argparse
 from mpi4py import MPI
 from timeit import default_timer as timer
+from pathlib import Path
 from dataclasses import dataclass
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
 
 
 def build_cli() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(prog="solver")
     parser.add_argument('-s', '--series', type=int, required=True, dest='series', help='Id of the series. THIS DOES NOT MEAN COMPUTATION WILL BE REPEATED')
-    parser.add_argument('--grid-points', type=int, required=True, dest='grid_points', help='Number of points on the grid (single side), total would be <this_value> ^ 2')
+    size_group = parser.add_mutually_exclusive_group(required=True)
+    size_group.add_argument('--grid-points', type=int, default=None, dest='grid_points', help='Number of points on the grid (single side), total would be <this_value> ^ 2')
+    size_group.add_argument('--points-per-rank', type=int, default=None, dest='points_per_rank',
+                            help='Weak scaling: the grid grows in rows with the ranks (workers of --backend shm), '
+                                 'every one keeps a stripe of about that many points, jacobi on stripes only')
+    parser.add_argument('--columns', type=int, default=None, dest='columns',
+                        help='Columns of the grid with --points-per-rank, which fix the halo of every rank, sqrt(--points-per-rank) by default')
     parser.add_argument('-a', '--side', type=float, required=True, dest='a', help='Side length of the membrane')
     parser.add_argument('--theta', type=float, required=True, dest='theta', help='Right side of the equation')
     parser.add_argument('--iters', type=int, required=True, dest='iters', help='Number of iterations in iterative method')
+    parser.add_argument('--overlap', action='store_true', dest='overlap', help='Update the interior rows while the halo rows are in flight (persistent requests), stripes only')
+    parser.add_argument('--decomposition', type=str, default='stripes', choices=['stripes', 'blocks'], dest='decomposition',
+                        help='stripes - horizontal stripes, blocks - 2D blocks on a Cartesian process grid')
+    parser.add_argument('--tol', type=float, default=None, dest='tol',
+                        help='Stop once the residual (relative to the right side) drops below this value, --iters becomes the iteration limit')
+    parser.add_argument('--check-every', type=int, default=10, dest='check_every', help='Residual is checked every that many iterations in --tol mode')
+    parser.add_argument('--method', type=str, default='jacobi', choices=['jacobi', 'sor', 'multigrid'], dest='method',
+                        help='jacobi - Jacobi iteration, sor - red-black successive over-relaxation, '
+                             'multigrid - geometric multigrid V-cycles (an iteration is a cycle), stripes only')
+    parser.add_argument('--omega', type=float, default=None, dest='omega', help='Relaxation factor of SOR, estimated from the grid size by default')
+    parser.add_argument('--fmg', action='store_true', dest='fmg', help='Start multigrid with a full multigrid pass')
+    parser.add_argument('--halo-depth', type=int, default=1, dest='halo_depth',
+                        help='Ghost rows exchanged at once, the stripe is swept that many times between the exchanges '
+                             '(recomputing the ghost rows), jacobi on stripes without --overlap only')
+    parser.add_argument('--threads-per-rank', type=int, default=1, dest='threads',
+                        help='Threads updating the stripe of every rank, jacobi on stripes without --overlap and --halo-depth only')
+    parser.add_argument('--backend', type=str, default='mpi', choices=['mpi', 'shm'], dest='backend',
+                        help='mpi ranks, or shm: worker processes on shared memory, started without mpiexec (jacobi on stripes only)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), dest='processes', help='Worker processes of the shm backend')
+    parser.add_argument('--kernel', type=str, default='auto', choices=['auto'] + list(KERNEL_MODULES), dest='kernel',
+                        help='Stencil kernel of jacobi on stripes, auto picks the fastest installed one by a short benchmark')
+    parser.add_argument('--dtype', type=str, default='float64', choices=['float64', 'float32', 'mixed'], dest='dtype',
+                        help='Precision of jacobi on stripes, mixed: float32 sweeps refined in float64 every --refine-every iterations. '
+                             'Error against float64 is reported for the others')
+    parser.add_argument('--refine-every', type=int, default=10, dest='refine_every', help='Iterations between the refinements in --dtype mixed')
+    parser.add_argument('--checkpoint-every', type=int, default=None, dest='checkpoint_every',
+                        help='Checkpoint the grid every that many iterations (written in the background)')
+    parser.add_argument('--checkpoint-dir', type=Path, default=Path(os.environ.get('SCRATCH', '.')).joinpath('checkpoints'), dest='checkpoint_dir',
+                        help='Directory of the checkpoints, $SCRATCH/checkpoints by default')
+    parser.add_argument('--resume', action='store_true', dest='resume',
+                        help='Start from the latest complete checkpoint, which may come from a different number of ranks')
+    parser.add_argument('--cache-dir', type=Path, default=None, dest='cache_dir',
+                        help='Take the grid from this cache of solutions scaled by theta * delta^2, or solve and store it there if it is missing')
+    parser.add_argument('--cache-entries', type=int, default=8, dest='cache_entries', help='Grids kept in --cache-dir, least recently used ones are removed')
+    parser.add_argument('--trace', type=Path, default=None, dest='trace',
+                        help='Write the time of every phase in every iteration of every rank into this CSV file (first worker only with --backend shm)')
+    parser.add_argument('--output', type=Path, default=None, dest='output',
+                        help='Write the grid to this .npy file with collective MPI-IO instead of gathering it on rank 0')
     return parser
 
 
 @dataclass
 class Args:
     series: int
-    grid_points: int
+    grid_points: Optional[int]
+    points_per_rank: Optional[int]
+    columns: Optional[int]
     a: float
     theta: float
     iters: int
+    overlap: bool
+    decomposition: str
+    tol: Optional[float]
+    check_every: int
+    method: str
+    omega: Optional[float]
+    fmg: bool
+    halo_depth: int
+    threads: int
+    backend: str
+    processes: int
+    kernel: str
+    dtype: str
+    refine_every: int
+    checkpoint_every: Optional[int]
+    checkpoint_dir: Path
+    resume: bool
+    cache_dir: Optional[Path]
+    cache_entries: int
+    trace: Optional[Path]
+    output: Optional[Path]
 
 
 def vsize_for_rank(mpi_rank: int, mpi_size: int, grid_points: int) -> int:
@@ -35,58 +122,1660 @@ def vsize_for_rank(mpi_rank: int, mpi_size: int, grid_points: int) -> int:
     return size
 
 
-def compute(comm, rank, size, delta, grid_points, theta, iters):
+# Phases `Profiler` charges the time to, `other` is the rest of the time of the rank (e.g. grid transfers of multigrid)
+PHASES = ['stencil', 'halo_wait', 'send', 'reduce', 'gather', 'io', 'other']
+# Line printed for a run, the phase columns are min, mean and max over the ranks of every phase
+CSV_HEADER = ','.join(['process_count', 'problem_size', 'series_id', 'time', 'iterations', 'residual', 'kernel', 'dtype', 'error',
+                       'points_per_rank', 'columns', 'throughput'] + [f'{phase}_{stat}' for phase in PHASES for stat in ['min', 'mean', 'max']])
+
+
+def csv_row(size, grid_points, series, elapsed, iterations, residual, kernel, dtype, error, phase_times, columns=None) -> str:
     """
-    :param delta: resolution of the grid
+    :param grid_points: rows of the grid, the problem size
+    :param elapsed: time of the run [s]
+    :param phase_times: see `Profiler.summary`
+    :param columns: of the grid, `grid_points` by default
+    :return: line of `CSV_HEADER` columns, throughput is the grid points updated per second by a rank
     """
+    columns = columns or grid_points
+    points_per_rank = grid_points * columns / size
+    throughput = grid_points * columns * iterations / elapsed / size
+    phase_columns = ','.join(str(t) for t in phase_times.reshape(-1))
+    return (f'{size},{grid_points},{series},{elapsed * 1000},{iterations},{residual},{kernel},{dtype},{error},{points_per_rank},{columns},'
+            f'{throughput},{phase_columns}')
 
-    # side = size * ppc
-    hsize = grid_points
-    vsize = vsize_for_rank(rank, size, grid_points)
 
-    # Rectangle this process is responsible for
-    H = np.zeros((vsize, hsize), dtype=np.float64)
-    # H_i = np.zeros((ppc, side), dtype=np.float64)
-    recv_buff = np.empty(hsize, dtype=np.float64)
+class Profiler:
+    """
+    Time spent by a rank in the phases of the solver. Sections are timed back to back, every `add` reads the clock once
+    and charges the time since the previous reading to a phase. With `trace` the phases of every iteration are kept too.
+    """
 
-    x_min = 0 if rank > 0 else 1
-    x_max = vsize if rank < size - 1 else vsize - 1
+    def __init__(self, trace=False):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        # (iteration, totals after it)
+        self.trace = [] if trace else None
+        # Times of the other workers of the shm backend, see `compute_shared`
+        self.peers = None
 
-    for i in range(iters):
-        H_i = np.zeros((vsize, hsize), dtype=np.float64)
-        if i > 0:
+    def add(self, phase, start) -> float:
+        """
+        :param start: clock reading the phase started at
+        :return: clock reading the phase ended at, the start of the next one
+        """
+        now = timer()
+        self.totals[phase] += now - start
+        return now
+
+    def end_iteration(self, i):
+        if self.trace is not None:
+            self.trace.append((i, [self.totals[phase] for phase in PHASES[:-1]]))
+
+    def times(self, elapsed) -> np.ndarray:
+        """
+        :param elapsed: time of the rank [s], the part not charged to any phase is `other`
+        :return: time of every phase [ms]
+        """
+        times = np.array([self.totals[phase] for phase in PHASES[:-1]] + [0.0])
+        times[-1] = max(0.0, elapsed - times.sum())
+        return times * 1000
+
+    def summary(self, comm, elapsed) -> np.ndarray:
+        """
+        :return: min, mean and max over the ranks (or the workers of the shm backend) of the time of every phase [ms],
+            shaped (len(PHASES), 3)
+        """
+        times = self.times(elapsed)
+        ranks = np.empty((comm.Get_size(), len(PHASES)), dtype=np.float64)
+        comm.Allgather(times, ranks)
+        if self.peers is not None:
+            ranks = np.vstack((ranks, self.peers))
+        return np.stack((ranks.min(axis=0), ranks.mean(axis=0), ranks.max(axis=0)), axis=1)
+
+    def write_trace(self, comm, path):
+        """
+        Writes the time of every phase [ms] in every iteration of every rank into a CSV file on rank 0
+        (of the first worker only with the shm backend).
+        """
+        iterations = np.array([i for i, _ in self.trace], dtype=np.int64)
+        totals = np.array([[0.0] * (len(PHASES) - 1)] + [totals for _, totals in self.trace])
+        traces = comm.gather((iterations, np.diff(totals, axis=0) * 1000), root=0)
+        if comm.Get_rank() == 0:
+            with open(path, 'w') as trace_file:
+                trace_file.write(','.join(['rank', 'iteration'] + PHASES[:-1]) + '\n')
+                for rank, (iterations, times) in enumerate(traces):
+                    for i, row in zip(iterations, times):
+                        trace_file.write(','.join([str(rank), str(i)] + [str(t) for t in row]) + '\n')
+
+
+def numpy_kernel(H, out, d2t, order):
+    """
+    Stencil kernels write the Jacobi value of rows 1, ..., n of `H` (neighbours before dividing by 4, terms summed
+    in `order`, see `JacobiSolver.row_order`) into the interior columns of the n rows of `out`.
+    Boundary columns of `out` may be overwritten with anything.
+
+    This one applies the formula with ufuncs on flat, contiguous views of the rows (2D views of the interior would make
+    them allocate their iteration buffers), the boundary columns caught in between get garbage.
+
+    :param d2t: delta^2 * theta, a number or an array shaped like `out`
+    """
+    hsize = H.shape[1]
+    H = H.reshape(-1)
+    start, stop = hsize + 1, len(H) - hsize - 1
+    out = out.reshape(-1)[1:-1]
+    d2t = d2t.reshape(-1)[1:-1] if isinstance(d2t, np.ndarray) else d2t
+    neighbours = {
+        'left': H[start - 1:stop - 1],
+        'right': H[start + 1:stop + 1],
+        'up': H[start - hsize:stop - hsize],
+        'down': H[start + hsize:stop + hsize],
+    }
+    if order[1] == 'theta':
+        np.subtract(neighbours[order[0]], d2t, out=out)
+        order = order[2:]
+    else:
+        np.copyto(out, neighbours[order[0]])
+        order = order[1:]
+    for term in order:
+        if term == 'theta':
+            np.subtract(out, d2t, out=out)
+        else:
+            np.add(out, neighbours[term], out=out)
+    np.divide(out, 4, out=out)
+
+
+# Neighbour sum of scipy.ndimage
+CROSS = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]], dtype=np.float64)
+
+
+def ndimage_kernel(H, out, d2t, order):
+    """
+    Same as `numpy_kernel` up to rounding, the neighbours are summed by `scipy.ndimage.correlate` in its own order.
+    """
+    neighbour_sum = ndimage.correlate(H, CROSS, mode='constant')
+    interior = out[:, 1:-1]
+    np.subtract(neighbour_sum[1:-1, 1:-1], d2t[:, 1:-1] if isinstance(d2t, np.ndarray) else d2t, out=interior)
+    np.divide(interior, 4, out=interior)
+
+
+# Columns updated at once by the fused kernel, the three rows read stay in cache
+TILE_COLUMNS = 1024
+# Summation orders of `JacobiSolver.row_order`
+ROW_ORDERS = [
+    ('left', 'theta', 'right', 'up', 'down'),
+    ('up', 'theta', 'left', 'right', 'down'),
+    ('down', 'theta', 'left', 'right', 'up'),
+    ('up', 'down', 'theta', 'left', 'right'),
+]
+
+
+def make_fused_update(order):
+    """
+    :return: Numba kernel summing the terms in `order`, known at compile time so that the loop gets vectorized
+    """
+    terms = ('left', 'right', 'up', 'down', 'theta')
+    a, b, c, d, e = (terms.index(term) for term in order)
+
+    @numba.njit(nogil=True, cache=True)
+    def fused_update(H, out, d2t, tile):
+        rows, columns = out.shape
+        for column_begin in range(1, columns - 1, tile):
+            column_end = min(column_begin + tile, columns - 1)
+            for r in range(rows):
+                for col in range(column_begin, column_end):
+                    # x - y is x + (-y) exactly, so the sum is the same as of `numpy_kernel`
+                    values = (H[r + 1, col - 1], H[r + 1, col + 1], H[r, col], H[r + 2, col], -d2t[r, col])
+                    out[r, col] = ((((values[a] + values[b]) + values[c]) + values[d]) + values[e]) / 4
+    return fused_update
+
+
+FUSED_UPDATES = {order: make_fused_update(order) for order in ROW_ORDERS} if numba is not None else {}
+
+
+def numba_kernel(H, out, d2t, order):
+    """
+    Single pass over the rows compiled with Numba, column tile after column tile, same bit for bit as `numpy_kernel`.
+    Releases the GIL. Compiled kernels are cached on disk.
+    """
+    if not isinstance(d2t, np.ndarray):
+        d2t = np.broadcast_to(out.dtype.type(d2t), out.shape)
+    FUSED_UPDATES[order](H, out, d2t, TILE_COLUMNS)
+
+
+# Kernels the optional dependencies are installed for
+KERNELS = {'numpy': numpy_kernel}
+if numba is not None:
+    KERNELS['numba'] = numba_kernel
+if ndimage is not None:
+    KERNELS['ndimage'] = ndimage_kernel
+KERNEL_MODULES = {'numpy': 'numpy', 'numba': 'numba', 'ndimage': 'scipy'}
+
+
+def select_kernel(comm, rows, columns, d2t, kernels, dtype=np.float64, repeats=3) -> str:
+    """
+    Microbenchmark of `kernels` on a stripe of `rows` x `columns`. The first calls are left out,
+    JIT kernels are compiled for every summation order then.
+
+    :return: the kernel fastest on the slowest rank
+    """
+    H = np.random.default_rng(0).random((rows + 2, columns)).astype(dtype)
+    out = np.empty((rows, columns), dtype=dtype)
+    times = np.full(len(kernels), np.inf)
+    for k, kernel in enumerate(kernels):
+        for order in ROW_ORDERS:
+            KERNELS[kernel](H, out, d2t, order)
+        for _ in range(repeats if len(kernels) > 1 else 0):
+            start_time = timer()
+            KERNELS[kernel](H, out, d2t, ROW_ORDERS[0])
+            times[k] = min(times[k], timer() - start_time)
+    comm.Allreduce(MPI.IN_PLACE, times, op=MPI.MAX)
+    return kernels[int(np.argmin(times))]
+
+
+class JacobiSolver:
+    """
+    Jacobi iteration on the stripe of a single rank. Two preallocated grids are swapped every iteration,
+    each with ghost rows above and below the stripe the halo rows are received into,
+    so the iteration itself allocates nothing.
+
+    With `overlap` the halo is exchanged with persistent requests bound to the ghost and edge rows of both grids,
+    the rows not reading the ghost rows are updated while the messages are in flight.
+
+    With `halo_depth` k > 1 (temporal blocking) k rows are exchanged every k-th iteration, the iterations in between
+    also recompute the part of the ghost rows that is still valid, one row less on each side every iteration.
+
+    With `threads` > 1 the stripe is updated by a pool of threads, see `step_threaded`.
+    """
+
+    def __init__(self, comm, rank, size, delta, grid_points, theta, overlap=False, damping=1.0, halo_depth=1, threads=1, grids=None,
+                 kernel='numpy', dtype=np.float64, profiler=None, columns=None):
+        """
+        :param grid_points: rows of the grid, split into the stripes
+        :param theta: right side, a number or an array shaped like the grid (with the ghost rows)
+        :param damping: weight of the update, the new value is H + damping * (Jacobi value - H)
+        :param halo_depth: ghost rows on each side, at most the number of rows of the smallest stripe
+        :param threads: worker threads updating the stripe, not supported with `overlap` and `halo_depth` > 1
+        :param grids: (H, H_next) to work on instead of allocating them, e.g. views of a grid shared with the neighbours
+        :param kernel: name of the stencil kernel in `KERNELS`
+        :param dtype: of the grids, halo rows are sent in it too
+        :param profiler: `Profiler` timing the phases
+        :param columns: of the grid, `grid_points` (a square grid) by default
+        """
+        self.comm = comm
+        self.rank = rank
+        self.size = size
+        self.grid_points = grid_points
+        self.hsize = columns or grid_points
+        self.vsize = vsize_for_rank(rank, size, grid_points)
+        self.offsets = np.concatenate(([0], np.cumsum([vsize_for_rank(r, size, grid_points) for r in range(size)])))
+        # Global position of the stripe
+        self.row_offset = self.offsets[rank]
+        self.col_offset = 0
+        self.d2t = delta ** 2 * theta
+        self.damping = damping
+        self.depth = halo_depth
+        self.kernel = KERNELS[kernel]
+        self.profiler = profiler if profiler is not None else Profiler()
+
+        # Rows [0, depth) and [depth + vsize, vsize + 2 * depth) are ghost rows,
+        # columns 0 and hsize - 1 stay zero (boundary condition)
+        if grids is None:
+            self.H = np.zeros((self.vsize + 2 * self.depth, self.hsize), dtype=dtype)
+            self.H_next = np.zeros_like(self.H)
+        else:
+            self.H, self.H_next = grids
+        # Differences between iterates, only filled in the iterations the residual is measured in
+        self.scratch = np.empty(self.vsize * self.hsize, dtype=self.H.dtype)
+        self.residual_sq = 0.0
+
+        # Rows (in grid coordinates) that are updated, the global boundary rows of the first and last rank are not
+        self.first_row = self.depth if rank > 0 else self.depth + 1
+        self.last_row = self.depth + self.vsize - 1 if rank < size - 1 else self.depth + self.vsize - 2
+        self.halo_blocks, self.inner_blocks = self.row_blocks()
+        # Blocks of the iterations 0, 1, ..., depth - 1 after an exchange
+        self.blocks = [sum(self.row_blocks(self.depth - 1 - j), []) for j in range(self.depth)]
+
+        # Halo is also exchanged before the first iteration, when resuming from a checkpoint
+        self.first_iteration = 0
+
+        self.threads = threads
+        # Grid `i % 2` holds the iterate of iteration i
+        self.grids = (self.H, self.H_next)
+        self.thread_blocks = self.split_rows(threads) if threads > 1 else None
+        # Started with the first iteration
+        self.workers = []
+
+        self.overlap = overlap
+        # Grids are swapped every iteration, so H is grid `i % 2` in iteration i
+        self.halo_requests = [self.init_halo_requests(grid) for grid in (self.H, self.H_next)] if overlap else None
+
+    def row_order(self, global_row):
+        """
+        Summation order of a row matches the original slice updates on the rank owning it, where the received halo rows
+        were added first, so that the results are the same bit for bit (also of the rows recomputed in the ghost rows).
+        """
+        owner = np.searchsorted(self.offsets, global_row, side='right') - 1
+        first, last = self.offsets[owner], self.offsets[owner + 1] - 1
+        if 0 < owner < self.size - 1 and first == last:
+            return 'up', 'down', 'theta', 'left', 'right'
+        if owner > 0 and global_row == first:
+            return 'up', 'theta', 'left', 'right', 'down'
+        if owner < self.size - 1 and global_row == last:
+            return 'down', 'theta', 'left', 'right', 'up'
+        return 'left', 'theta', 'right', 'up', 'down'
+
+    def row_blocks(self, extension=0):
+        """
+        Splits the updated rows, extended by `extension` ghost rows on the sides with a neighbour,
+        into blocks of (begin, end, summation order) - see `row_order`. Blocks never span the edge of the stripe.
+
+        :return: blocks reading the ghost rows, blocks that do not
+        """
+        global_offset = self.offsets[self.rank] - self.depth
+        # Global boundary rows caught in the ghost rows are not updated either
+        begin = max(self.first_row - (extension if self.rank > 0 else 0), 1 - global_offset)
+        end = min(self.last_row + 1 + (extension if self.rank < self.size - 1 else 0), self.grid_points - 1 - global_offset)
+        halo_blocks, inner_blocks = [], []
+        while begin < end:
+            order = self.row_order(global_offset + begin)
+            block_end = begin + 1
+            while (block_end < end and self.row_order(global_offset + block_end) == order
+                   and block_end not in (self.depth, self.depth + self.vsize)):
+                block_end += 1
+            if order[0] == 'left':
+                inner_blocks.append((begin, block_end, order))
+            else:
+                halo_blocks.append((begin, block_end, order))
+            begin = block_end
+        return halo_blocks, inner_blocks
+
+    def split_rows(self, threads) -> list:
+        """
+        :return: blocks (see `row_blocks`) of every thread, contiguous ranges of the updated rows of about the same size
+        """
+        begin, end = self.first_row, self.last_row + 1
+        n_threads = max(1, min(threads, end - begin))
+        thread_blocks = []
+        for t in range(n_threads):
+            t_begin = begin + sum(vsize_for_rank(s, n_threads, end - begin) for s in range(t))
+            t_end = t_begin + vsize_for_rank(t, n_threads, end - begin)
+            thread_blocks.append([(max(b, t_begin), min(e, t_end), order) for b, e, order in self.blocks[0] if max(b, t_begin) < min(e, t_end)])
+        return thread_blocks
+
+    def init_halo_requests(self, grid) -> list:
+        requests = []
+        if self.rank > 0:
+            requests.append(self.comm.Send_init(grid[1], self.rank - 1))
+            requests.append(self.comm.Recv_init(grid[0], self.rank - 1))
+        if self.rank < self.size - 1:
+            requests.append(self.comm.Send_init(grid[self.vsize], self.rank + 1))
+            requests.append(self.comm.Recv_init(grid[-1], self.rank + 1))
+        return requests
+
+    def exchange_halo(self, i) -> list:
+        """
+        Sends edge rows computed in the previous iteration and receives the neighbours' ones into the ghost rows,
+        every `depth`-th iteration. Edge rows are sent straight from the grid,
+        so the returned send requests have to complete before it is written.
+        """
+        send_requests = []
+        d = self.depth
+        if i > 0 and (i % d == 0 or i == self.first_iteration):
+            t = timer()
+            if self.rank > 0:
+                send_requests.append(self.comm.Isend(self.H[d:2 * d], self.rank - 1, i - 1))
+            if self.rank < self.size - 1:
+                send_requests.append(self.comm.Isend(self.H[self.vsize:self.vsize + d], self.rank + 1, i - 1))
+            t = self.profiler.add('send', t)
             # We receive values from last iteration from our neighs
-            if rank > 0:
-                comm.Recv(recv_buff, rank - 1, i - 1)
-                H_i[0] += recv_buff
-            if rank < size - 1:
-                # recv_buff = np.zeros(side, dtype=np.float64)
-                comm.Recv(recv_buff, rank + 1, i - 1)
-                H_i[-1] += recv_buff
+            if self.rank > 0:
+                self.comm.Recv(self.H[:d], self.rank - 1, i - 1)
+            if self.rank < self.size - 1:
+                self.comm.Recv(self.H[self.vsize + d:], self.rank + 1, i - 1)
+            self.profiler.add('halo_wait', t)
+        return send_requests
+
+    def update_rows(self, begin, end, order, measure_residual=False, grids=None) -> float:
+        """
+        Applies the formula to grid rows [begin, end) of H with the stencil kernel, writing into H_next
+        without temporaries (with the NumPy kernel). Disjoint rows may be updated concurrently.
+
+        :param order: terms in the order they are summed, a neighbour name or `theta` for -delta^2 * theta
+        :param grids: (H, H_next), the current ones by default
+        :return: sum of squares of the update if `measure_residual`, 0 otherwise
+        """
+        H_grid, H_next = grids if grids is not None else (self.H, self.H_next)
+        self.kernel(H_grid[begin - 1:end + 1], H_next[begin:end], self.d2t[begin:end] if isinstance(self.d2t, np.ndarray) else self.d2t, order)
+        H = H_grid.reshape(-1)
+        start, stop = begin * self.hsize + 1, end * self.hsize - 1
+        out = H_next.reshape(-1)[start:stop]
+        if self.damping != 1:
+            np.subtract(out, H[start:stop], out=out)
+            np.multiply(out, self.damping, out=out)
+            np.add(out, H[start:stop], out=out)
+        H_next[begin:end, 0] = 0
+        H_next[begin:end, -1] = 0
+
+        if not measure_residual:
+            return 0.0
+        # Boundary columns are zero in both grids, they do not contribute
+        diff = self.scratch[start - self.depth * self.hsize:stop - self.depth * self.hsize]
+        np.subtract(out, H[start:stop], out=diff)
+        return float(np.dot(diff, diff))
+
+    def step(self, i, measure_residual=False):
+        """
+        :param measure_residual: sum squares of the update into `residual_sq` on the way
+        """
+        self.residual_sq = 0.0
+        if self.overlap:
+            requests = self.halo_requests[i % 2] if i > 0 else []
+            t = timer()
+            MPI.Prequest.Startall(requests)
+            t = self.profiler.add('send', t)
+            # Edge rows are only read while being sent, which is fine
+            for block in self.inner_blocks:
+                self.residual_sq += self.update_rows(*block, measure_residual)
+            t = self.profiler.add('stencil', t)
+            MPI.Request.Waitall(requests)
+            t = self.profiler.add('halo_wait', t)
+            for block in self.halo_blocks:
+                self.residual_sq += self.update_rows(*block, measure_residual)
+            self.profiler.add('stencil', t)
+        elif self.threads > 1:
+            self.step_threaded(i, measure_residual)
+        else:
+            send_requests = self.exchange_halo(i)
+            t = timer()
+            for begin, end, order in self.blocks[i % self.depth]:
+                # Rows recomputed in the ghost rows belong to the neighbours
+                own = self.depth <= begin < self.depth + self.vsize
+                self.residual_sq += self.update_rows(begin, end, order, measure_residual and own)
+            t = self.profiler.add('stencil', t)
+            MPI.Request.Waitall(send_requests)
+            self.profiler.add('send', t)
+
+        self.H, self.H_next = self.H_next, self.H
+
+    def start_workers(self, i):
+        n_threads = len(self.thread_blocks)
+        self.condition = threading.Condition()
+        # Iterations finished by every thread, iterations the threads may start and the measured ones
+        self.done = [i] * n_threads
+        self.released = i
+        self.measured = set()
+        self.partial_sq = [0.0] * n_threads
+        self.stopping = False
+        self.workers = [threading.Thread(target=self.work, args=(t, i), daemon=True) for t in range(n_threads)]
+        for worker in self.workers:
+            worker.start()
+
+    def work(self, t, i):
+        blocks = self.thread_blocks[t]
+        last = len(self.thread_blocks) - 1
+        while True:
+            with self.condition:
+                # Neighbouring threads read the edge rows of this one from the previous iteration
+                # and the grid written now in the previous iteration
+                self.condition.wait_for(lambda: self.stopping or (
+                    self.released > i and (t == 0 or self.done[t - 1] >= i) and (t == last or self.done[t + 1] >= i)))
+                if self.stopping:
+                    return
+                measure_residual = i in self.measured
+            grids = self.grids[i % 2], self.grids[(i + 1) % 2]
+            partial_sq = sum(self.update_rows(begin, end, order, measure_residual, grids) for begin, end, order in blocks)
+            with self.condition:
+                self.partial_sq[t] = partial_sq
+                self.done[t] = i + 1
+                self.condition.notify_all()
+            i += 1
+
+    def step_threaded(self, i, measure_residual=False):
+        """
+        Rows are split between worker threads, every thread keeps its rows over the iterations
+        (NumPy releases the GIL in the ufuncs). There is no barrier between the iterations: a thread only waits
+        for its neighbours to finish the previous iteration, and this one only for the first and the last thread,
+        whose edge rows are exchanged with the neighbouring ranks. Other threads may still be running when it returns,
+        unless the residual is measured.
+        """
+        if not self.workers:
+            self.start_workers(i)
+        last = len(self.thread_blocks) - 1
+        # Time of this thread, waiting for the worker threads is the stencil
+        t = timer()
+        with self.condition:
+            self.condition.wait_for(lambda: self.done[0] >= i and self.done[last] >= i)
+        self.profiler.add('stencil', t)
+        send_requests = self.exchange_halo(i)
+        t = timer()
+        MPI.Request.Waitall(send_requests)
+        t = self.profiler.add('send', t)
+        with self.condition:
+            if measure_residual:
+                self.measured.add(i)
+            self.released = i + 1
+            self.condition.notify_all()
+            if measure_residual:
+                self.condition.wait_for(lambda: min(self.done) > i)
+                self.residual_sq = sum(self.partial_sq)
+                self.measured.discard(i)
+        self.profiler.add('stencil', t)
+
+    def synchronize(self):
+        """
+        Waits for the worker threads to finish the iterations started so far.
+        """
+        if self.workers:
+            with self.condition:
+                self.condition.wait_for(lambda: min(self.done) >= self.released)
+
+    def close(self):
+        if self.halo_requests is not None:
+            for request in self.halo_requests[0] + self.halo_requests[1]:
+                request.Free()
+            self.halo_requests = None
+        if self.workers:
+            self.synchronize()
+            with self.condition:
+                self.stopping = True
+                self.condition.notify_all()
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+
+    def stripe(self) -> np.ndarray:
+        self.synchronize()
+        return self.H[self.depth:self.depth + self.vsize]
+
+
+class MixedPrecisionSolver:
+    """
+    Jacobi with iterative refinement. Every `refine_every` iterations the iterate u is refined in float64:
+    a float64 Jacobi sweep gives its update, -delta^2 / 4 times the residual. The iterations until the next refinement
+    are float32 Jacobi sweeps of the correction e (Laplacian(e) = residual) started from that update,
+    u + e is the next iterate. Starting from zero the correction would be the Jacobi iterates minus u, so it is
+    Jacobi all along, but only one iteration in `refine_every` moves float64 grids and halo rows.
+    Rounding of the correction only affects digits below its size, which goes down as the iterates converge,
+    the accuracy is not limited to float32.
+    """
+
+    def __init__(self, comm, rank, size, delta, grid_points, theta, refine_every, kernel='numpy', profiler=None, columns=None):
+        self.exact = JacobiSolver(comm, rank, size, delta, grid_points, theta, kernel=kernel, profiler=profiler, columns=columns)
+        # Right side (delta^2 times it) is filled in `refine`
+        self.correction = JacobiSolver(comm, rank, size, 1.0, grid_points, np.zeros_like(self.exact.H, dtype=np.float32),
+                                       kernel=kernel, dtype=np.float32, profiler=profiler, columns=columns)
+        self.refine_every = refine_every
+        self.row_offset = self.exact.row_offset
+        self.col_offset = self.exact.col_offset
+        # Iterations are counted from it, it is set when resuming from a checkpoint
+        self.first_iteration = 0
+        # Whether the correction is added to the refined iterate (kept in H_next of the float64 solver), see `stripe`
+        self.corrected = True
+        self.residual_sq = 0.0
+
+    def refine(self, measure_residual=False):
+        exact, correction = self.exact, self.correction
+        self.stripe()
+        exact.step(1, measure_residual)
+        self.residual_sq = exact.residual_sq
+        # Update of the sweep is the first Jacobi iterate of the correction (starting from zero)
+        # and -1/4 of its right side
+        rows = slice(1, exact.vsize + 1)
+        update = correction.stripe()
+        np.subtract(exact.H[rows], exact.H_next[rows], out=update)
+        np.multiply(update, -4, out=correction.d2t[rows])
+        self.corrected = False
+
+    def step(self, i, measure_residual=False):
+        """
+        :param measure_residual: sum squares of the update into `residual_sq`, in float32 between the refinements
+        """
+        if (i - self.first_iteration) % self.refine_every == 0:
+            self.refine(measure_residual)
+        else:
+            self.correction.step(1, measure_residual)
+            self.residual_sq = self.correction.residual_sq
+            self.corrected = False
+
+    def close(self):
+        self.exact.close()
+        self.correction.close()
+
+    def stripe(self) -> np.ndarray:
+        """
+        :return: current iterate, refined iterate plus the correction
+        """
+        exact = self.exact
+        if not self.corrected:
+            np.add(exact.H_next[1:exact.vsize + 1], self.correction.stripe(), out=exact.stripe())
+            self.corrected = True
+        return exact.stripe()
+
+
+class BlockDecomposition:
+    """
+    Block of the grid owned by a single rank. Ranks are arranged on a Cartesian process grid with `dims`
+    (picked by `MPI.Compute_dims` by default), so the halo shrinks with the number of ranks in both directions.
+    Rows of the halo are contiguous, columns are sent and received in place with a strided vector datatype.
+    Subclasses allocate the grids `H` (with a ghost layer all around the block) and run the iteration.
+    """
+
+    def __init__(self, comm, size, delta, grid_points, theta, dims=None, odd_width=False, profiler=None):
+        """
+        :param odd_width: pad rows of the grid with a column after the right ghost column, if needed for an odd length
+        :param profiler: `Profiler` timing the phases
+        """
+        dims = MPI.Compute_dims(size, [0, 0]) if dims is None else dims
+        self.comm = comm.Create_cart(dims, periods=[False, False], reorder=True)
+        coords = self.comm.Get_coords(self.comm.Get_rank())
+        self.grid_points = grid_points
+        self.d2t = delta ** 2 * theta
+        self.profiler = profiler if profiler is not None else Profiler()
+
+        self.vsize = vsize_for_rank(coords[0], dims[0], grid_points)
+        self.hsize = vsize_for_rank(coords[1], dims[1], grid_points)
+        self.row_offset = sum(vsize_for_rank(c, dims[0], grid_points) for c in range(coords[0]))
+        self.col_offset = sum(vsize_for_rank(c, dims[1], grid_points) for c in range(coords[1]))
+        self.width = self.hsize + 2
+        if odd_width and self.width % 2 == 0:
+            self.width += 1
+
+        # Updated rows and columns (in grid coordinates), global boundary ones stay zero
+        self.first_row = 2 if self.row_offset == 0 else 1
+        self.last_row = self.vsize - 1 if self.row_offset + self.vsize == grid_points else self.vsize
+        self.first_col = 2 if self.col_offset == 0 else 1
+        self.last_col = self.hsize - 1 if self.col_offset + self.hsize == grid_points else self.hsize
+
+        self.column_type = MPI.DOUBLE.Create_vector(self.vsize, 1, self.width).Commit()
+
+    def init_halo_requests(self, grid) -> list:
+        # Neighbours on the global boundary are MPI.PROC_NULL, communication with them does nothing
+        up, down = self.comm.Shift(0, 1)
+        left, right = self.comm.Shift(1, 1)
+        flat = grid.reshape(-1)
+        W, R, C = self.width, self.vsize, self.hsize
+        row = lambda r: flat[r * W + 1:r * W + 1 + C]
+        column = lambda c: [flat[W + c:], 1, self.column_type]
+        return [
+            self.comm.Send_init(row(1), up, 0), self.comm.Recv_init(row(0), up, 0),
+            self.comm.Send_init(row(R), down, 0), self.comm.Recv_init(row(R + 1), down, 0),
+            self.comm.Send_init(column(1), left, 1), self.comm.Recv_init(column(0), left, 1),
+            self.comm.Send_init(column(C), right, 1), self.comm.Recv_init(column(C + 1), right, 1),
+        ]
+
+    def update_range(self):
+        """
+        :return: flat range from the first to the last updated point, empty if the block has no such points
+        """
+        if self.first_row > self.last_row or self.first_col > self.last_col:
+            return 0, 0
+        W = self.width
+        return self.first_row * W + self.first_col, self.last_row * W + self.last_col + 1
+
+    def close(self):
+        self.column_type.Free()
+        self.comm.Free()
+
+    def stripe(self) -> np.ndarray:
+        """
+        :return: block owned by this rank, rows [row_offset, row_offset + vsize) and columns [col_offset, col_offset + hsize) of the grid
+        """
+        return self.H[1:self.vsize + 1, 1:self.hsize + 1]
+
+
+class BlockJacobiSolver(BlockDecomposition):
+    """
+    Jacobi iteration on a 2D block of the grid.
+    All points are summed in the same order, so the result does not depend on the process grid.
+    """
+
+    def __init__(self, comm, rank, size, delta, grid_points, theta, profiler=None):
+        super().__init__(comm, size, delta, grid_points, theta, profiler=profiler)
+        self.H = np.zeros((self.vsize + 2, self.width), dtype=np.float64)
+        self.H_next = np.zeros_like(self.H)
+        # Differences between iterates, viewed with the grid's row length so that ghost columns can be masked out
+        self.scratch = np.empty(self.H.size, dtype=np.float64)
+        self.residual_sq = 0.0
+        self.halo_requests = [self.init_halo_requests(grid) for grid in (self.H, self.H_next)]
+
+    def step(self, i, measure_residual=False):
+        """
+        :param measure_residual: sum squares of the update into `residual_sq` on the way
+        """
+        self.residual_sq = 0.0
+        t = timer()
+        if i > 0:
+            requests = self.halo_requests[i % 2]
+            MPI.Prequest.Startall(requests)
+            t = self.profiler.add('send', t)
+            MPI.Request.Waitall(requests)
+            t = self.profiler.add('halo_wait', t)
+
+        start, stop = self.update_range()
+        if start < stop:
+            # One flat, contiguous range from the first to the last updated point - points caught in between
+            # are ghost columns (overwritten by the next exchange, never sent) and global boundary columns, zeroed below
+            H = self.H.reshape(-1)
+            W = self.width
+            out = self.H_next.reshape(-1)[start:stop]
+            np.subtract(H[start - 1:stop - 1], self.d2t, out=out)
+            np.add(out, H[start + 1:stop + 1], out=out)
+            np.add(out, H[start - W:stop - W], out=out)
+            np.add(out, H[start + W:stop + W], out=out)
+            np.divide(out, 4, out=out)
+            if self.col_offset == 0:
+                self.H_next[self.first_row:self.last_row + 1, 1] = 0
+            if self.col_offset + self.hsize == self.grid_points:
+                self.H_next[self.first_row:self.last_row + 1, self.hsize] = 0
+
+            if measure_residual:
+                np.subtract(out, H[start:stop], out=self.scratch[start:stop])
+                # Ghost columns caught in the range hold halo values in H, they are not part of the block
+                scratch = self.scratch.reshape(self.H.shape)
+                scratch[self.first_row:self.last_row + 1, 0] = 0
+                scratch[self.first_row:self.last_row + 1, -1] = 0
+                diff = self.scratch[start:stop]
+                self.residual_sq += np.dot(diff, diff)
+        self.profiler.add('stencil', t)
+
+        self.H, self.H_next = self.H_next, self.H
+
+    def close(self):
+        for request in self.halo_requests[0] + self.halo_requests[1]:
+            request.Free()
+        super().close()
+
+
+class RedBlackSORSolver(BlockDecomposition):
+    """
+    Successive over-relaxation in red-black order, in place on a single grid. Point (r, c) of the grid is red
+    if r + c is even; every half-sweep updates the points of one colour, which only read points of the other one,
+    so a half-sweep is a vectorized update and the result does not depend on the decomposition.
+    The halo is exchanged before each half-sweep.
+
+    Rows are padded to an odd length, then the points of one colour are every other element of the flat grid
+    and their neighbours are every other element shifted by 1 or by the row length.
+    """
+
+    def __init__(self, comm, rank, size, delta, grid_points, theta, omega, decomposition='stripes', profiler=None):
+        dims = [size, 1] if decomposition == 'stripes' else None
+        super().__init__(comm, size, delta, grid_points, theta, dims, odd_width=True, profiler=profiler)
+        self.omega = omega
+        self.H = np.zeros((self.vsize + 2, self.width), dtype=np.float64)
+        self.residual_sq = 0.0
+        self.halo_requests = self.init_halo_requests(self.H)
+
+        start, stop = self.update_range()
+        self.colours = []
+        for colour in (0, 1):
+            # Flat index parity equals the parity of row + column, since the row length is odd
+            first = start + (start + colour + self.row_offset + self.col_offset) % 2
+            columns = np.arange(first, stop, 2) % self.width
+            # Ghost, padding and global boundary columns caught in the range are left as they are
+            fixed = np.flatnonzero((columns < self.first_col) | (columns > self.last_col))
+            self.colours.append((first, stop, fixed))
+        self.scratch = np.empty(max(0, (stop - start + 1) // 2), dtype=np.float64)
+
+    def update_colour(self, colour, measure_residual=False):
+        first, stop, fixed = self.colours[colour]
+        H = self.H.reshape(-1)
+        W = self.width
+        points = H[first:stop:2]
+        correction = self.scratch[:len(points)]
+        # Gauss-Seidel value minus the current one, that is delta^2 / 4 times the residual at the point
+        np.add(H[first - 1:stop - 1:2], H[first + 1:stop + 1:2], out=correction)
+        np.add(correction, H[first - W:stop - W:2], out=correction)
+        np.add(correction, H[first + W:stop + W:2], out=correction)
+        np.subtract(correction, self.d2t, out=correction)
+        np.divide(correction, 4, out=correction)
+        np.subtract(correction, points, out=correction)
+        correction[fixed] = 0
+        if measure_residual:
+            self.residual_sq += np.dot(correction, correction)
+        np.multiply(correction, self.omega, out=correction)
+        np.add(points, correction, out=points)
+
+    def step(self, i, measure_residual=False):
+        """
+        :param measure_residual: sum squares of the Gauss-Seidel corrections into `residual_sq` on the way
+        """
+        self.residual_sq = 0.0
+        for colour in (0, 1):
+            t = timer()
+            MPI.Prequest.Startall(self.halo_requests)
+            t = self.profiler.add('send', t)
+            MPI.Request.Waitall(self.halo_requests)
+            t = self.profiler.add('halo_wait', t)
+            self.update_colour(colour, measure_residual)
+            self.profiler.add('stencil', t)
+
+    def close(self):
+        for request in self.halo_requests:
+            request.Free()
+        super().close()
+
+
+def optimal_omega(grid_points) -> float:
+    """
+    Optimal SOR relaxation factor for the model Poisson problem, 2 / (1 + sqrt(1 - rho^2)),
+    with rho = cos(pi * h) the spectral radius of the Jacobi iteration.
+    """
+    return 2 / (1 + np.sin(np.pi / (grid_points - 1)))
+
+
+# Multigrid levels are coarsened down to that many points (single side), the coarsest level is solved directly
+COARSEST_POINTS = 17
+# Coarse levels are gathered onto fewer ranks, so that every rank has at least that many rows
+MIN_ROWS_PER_RANK = 16
+SMOOTHING_STEPS = 2
+# Weighted Jacobi with 4/5 damps the high frequencies best for the 5-point stencil
+SMOOTHER_DAMPING = 0.8
+
+
+def interpolation(n_in, n_out):
+    """
+    Linear interpolation from `n_in` to `n_out` uniformly spaced points on the same segment,
+    output point o is `sum_k weights[o, k] * input[index[o, k]]`.
+
+    :return: (index, weights), both of shape (n_out, 2)
+    """
+    x = np.arange(n_out) * ((n_in - 1) / (n_out - 1))
+    left = np.minimum(np.floor(x).astype(np.int64), n_in - 2)
+    fraction = x - left
+    return np.stack((left, left + 1), axis=1), np.stack((1 - fraction, fraction), axis=1)
 
-        # We apply the formula
-        H_i[x_min : x_max, 1 : hsize - 1] -= delta ** 2 * theta
-        H_i[x_min : x_max, 1 : hsize - 1] += H[x_min : x_max, 0 : hsize - 2]
-        H_i[x_min : x_max, 1 : hsize - 1] += H[x_min : x_max, 2 : hsize]
-        H_i[1 : x_max, :] += H[0 : x_max - 1, :]
-        H_i[x_min : vsize - 1, :] += H[x_min + 1 : vsize, :]
 
-        H_i /= 4
-        H = H_i
+def restriction(n_fine, n_coarse):
+    """
+    Transpose of `interpolation(n_coarse, n_fine)` with the weights of every coarse point scaled to sum to one,
+    which is full weighting when the coarse points are every other fine point.
+
+    :return: (index, weights) of shape (n_coarse, k), unused entries repeat the first index with zero weight
+    """
+    index, weights = interpolation(n_coarse, n_fine)
+    fine = np.repeat(np.arange(n_fine), 2)
+    coarse, weights = index.reshape(-1), weights.reshape(-1)
+    order = np.lexsort((fine, coarse))
+    fine, coarse, weights = fine[order], coarse[order], weights[order]
+    counts = np.bincount(coarse, minlength=n_coarse)
+    position = np.arange(len(coarse)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    r_index = np.repeat(fine[np.cumsum(counts) - counts][:, np.newaxis], counts.max(), axis=1)
+    r_weights = np.zeros(r_index.shape, dtype=np.float64)
+    r_index[coarse, position] = fine
+    r_weights[coarse, position] = weights
+    return r_index, r_weights / r_weights.sum(axis=1, keepdims=True)
+
+
+def transfer(values, index, weights, axis) -> np.ndarray:
+    """
+    Applies a transfer operator (see `interpolation`) along `axis` of `values`.
+    """
+    shape = (-1, 1) if axis == 0 else (1, -1)
+    out = np.take(values, index[:, 0], axis=axis)
+    out *= weights[:, 0].reshape(shape)
+    buff = np.empty_like(out)
+    for k in range(1, index.shape[1]):
+        np.take(values, index[:, k], axis=axis, out=buff)
+        buff *= weights[:, k].reshape(shape)
+        out += buff
+    return out
+
+
+class RowTransfer:
+    """
+    Applies a transfer operator (see `interpolation`) along the rows of a grid distributed in stripes,
+    input and output stripes may be distributed differently. Input rows needed by every rank are known
+    from the offsets of the stripes upfront, so they are fetched with a single Alltoallv.
+    """
+
+    def __init__(self, comm, index, weights, in_offsets, out_offsets):
+        self.comm = comm
+        rank = comm.Get_rank()
+        size = comm.Get_size()
+        # Input rows [lo, hi) needed by every rank
+        needed = np.zeros((size, 2), dtype=np.int64)
+        for r in range(size):
+            rows = index[out_offsets[r]:out_offsets[r + 1]]
+            if len(rows) > 0:
+                needed[r] = rows.min(), rows.max() + 1
+        self.lo, self.hi = needed[rank]
+        self.in_offset = in_offsets[rank]
+        self.index = index[out_offsets[rank]:out_offsets[rank + 1]] - self.lo
+        self.weights = weights[out_offsets[rank]:out_offsets[rank + 1]]
+
+        overlap = lambda lo, hi, r: (max(lo, in_offsets[r]), max(min(hi, in_offsets[r + 1]), max(lo, in_offsets[r])))
+        self.send_rows = [overlap(lo, hi, rank) for lo, hi in needed]
+        self.recv_counts = np.array([end - begin for begin, end in (overlap(self.lo, self.hi, r) for r in range(size))], dtype=np.int64)
+
+    def apply(self, values) -> np.ndarray:
+        """
+        :param values: input rows owned by this rank
+        """
+        width = values.shape[1]
+        send = [values[begin - self.in_offset:end - self.in_offset] for begin, end in self.send_rows]
+        send_counts = np.array([len(rows) for rows in send], dtype=np.int64) * width
+        send_buff = np.concatenate(send).reshape(-1) if len(send) > 0 else np.empty(0, dtype=np.float64)
+        recv_buff = np.empty((self.hi - self.lo, width), dtype=np.float64)
+        recv_counts = self.recv_counts * width
+        self.comm.Alltoallv([send_buff, (send_counts, np.cumsum(send_counts) - send_counts), MPI.DOUBLE],
+                            [recv_buff, (recv_counts, np.cumsum(recv_counts) - recv_counts), MPI.DOUBLE])
+
+        return transfer(recv_buff, self.index, self.weights, axis=0)
+
+
+@dataclass
+class MultigridLevel:
+    grid_points: int
+    delta: float
+    # Rows [offsets[r], offsets[r + 1]) belong to rank r, ranks not taking part in the level have none
+    offsets: np.ndarray
+    comm: Optional[MPI.Comm]
+    solver: Optional[JacobiSolver]
+
+    def stripe(self) -> np.ndarray:
+        if self.solver is None:
+            return np.empty((0, self.grid_points), dtype=np.float64)
+        return self.solver.stripe()
+
+
+class MultigridSolver:
+    """
+    Geometric multigrid on stripes. Every level has about half the points of the finer one in both directions,
+    grids are related by linear interpolation between their points, so any grid size coarsens
+    (grids with 2^k + 1 points get the textbook bilinear interpolation and full weighting).
+    Damped `JacobiSolver` sweeps smooth the error, the coarsest level is solved directly on a single rank.
+    Coarse levels too small to give every rank `MIN_ROWS_PER_RANK` rows are gathered onto fewer ranks.
+
+    Each step is a V-cycle, with `fmg` the first one is preceded by a full multigrid pass
+    (coarse solutions interpolated as initial guesses of the finer levels).
+    """
+
+    def __init__(self, comm, rank, size, delta, grid_points, theta, fmg=False, profiler=None):
+        self.comm = comm
+        self.theta = theta
+        self.fmg = fmg
+        side = delta * (grid_points - 1)
+        sizes = [grid_points]
+        while sizes[-1] > COARSEST_POINTS:
+            sizes.append((sizes[-1] + 1) // 2)
+        if len(sizes) == 1 and size > 1:
+            # Coarsest level is solved on a single rank, a grid that small is gathered onto one as it is
+            sizes.append(grid_points)
+
+        self.levels = []
+        for l, n in enumerate(sizes):
+            if l == len(sizes) - 1 and l > 0:
+                active = 1
+            elif l == 0:
+                active = size
+            else:
+                active = max(1, min(size, n // MIN_ROWS_PER_RANK))
+            offsets = np.zeros(size + 1, dtype=np.int64)
+            offsets[1:active + 1] = np.cumsum([vsize_for_rank(r, active, n) for r in range(active)])
+            offsets[active + 1:] = offsets[active]
+            level_comm = comm.Split(0 if rank < active else MPI.UNDEFINED, rank)
+            level_delta = side / (n - 1)
+            solver = None
+            if rank < active:
+                # Right side of coarse levels is a grid, filled with the restricted residual
+                level_theta = theta if l == 0 else np.zeros((offsets[rank + 1] - offsets[rank] + 2, n), dtype=np.float64)
+                solver = JacobiSolver(level_comm, rank, active, level_delta, n, level_theta, damping=SMOOTHER_DAMPING, profiler=profiler)
+            self.levels.append(MultigridLevel(n, level_delta, offsets, level_comm, solver))
+
+        self.restrictions = []
+        self.prolongations = []
+        for fine, coarse in zip(self.levels[:-1], self.levels[1:]):
+            r_index, r_weights = restriction(fine.grid_points, coarse.grid_points)
+            p_index, p_weights = interpolation(coarse.grid_points, fine.grid_points)
+            self.restrictions.append((RowTransfer(comm, r_index, r_weights, fine.offsets, coarse.offsets), r_index, r_weights))
+            self.prolongations.append((RowTransfer(comm, p_index, p_weights, coarse.offsets, fine.offsets), p_index, p_weights))
+
+        self.row_offset = self.levels[0].offsets[rank]
+        self.col_offset = 0
+
+        coarsest = self.levels[-1]
+        self.coarse_inverse = None
+        if coarsest.solver is not None:
+            # delta^2 times the Laplacian over the interior points
+            n = coarsest.grid_points - 2
+            T = np.diag(np.full(n, -2.0)) + np.diag(np.ones(n - 1), 1) + np.diag(np.ones(n - 1), -1)
+            self.coarse_inverse = np.linalg.inv(np.kron(np.eye(n), T) + np.kron(T, np.eye(n)))
+        self.residual_sq = 0.0
+
+    def smooth(self, level):
+        if level.solver is not None:
+            for _ in range(SMOOTHING_STEPS):
+                level.solver.step(1)
+
+    def solve_coarsest(self):
+        level = self.levels[-1]
+        if level.solver is not None:
+            n = level.grid_points
+            d2t = np.broadcast_to(level.solver.d2t, level.solver.H.shape)
+            # Grid row g is row g + 1 of H
+            level.solver.H[2:n, 1:n - 1] = (self.coarse_inverse @ d2t[2:n, 1:n - 1].reshape(-1)).reshape(n - 2, n - 2)
+
+    def residual(self, level) -> np.ndarray:
+        """
+        :return: residual of the stripe of `level`, theta - Laplacian(H), zero on the global boundary
+        """
+        solver = level.solver
+        if solver is None:
+            return np.empty((0, level.grid_points), dtype=np.float64)
+        # A sweep without the swap leaves H + damping * (Jacobi value - H) in H_next,
+        # the Jacobi value minus H is -delta^2 / 4 times the residual
+        send_requests = solver.exchange_halo(1)
+        for block in solver.halo_blocks + solver.inner_blocks:
+            solver.update_rows(*block)
+        MPI.Request.Waitall(send_requests)
+        residual = solver.H[1:solver.vsize + 1] - solver.H_next[1:solver.vsize + 1]
+        residual *= 4 / (solver.damping * level.delta ** 2)
+        return residual
+
+    def prolong(self, l) -> np.ndarray:
+        """
+        :return: stripe of level `l + 1` interpolated onto the stripe of level `l`
+        """
+        rows, index, weights = self.prolongations[l]
+        return transfer(rows.apply(self.levels[l + 1].stripe()), index, weights, axis=1)
+
+    def v_cycle(self, l):
+        if l == len(self.levels) - 1:
+            self.solve_coarsest()
+            return
+        level, coarse = self.levels[l], self.levels[l + 1]
+        self.smooth(level)
+
+        rows, index, weights = self.restrictions[l]
+        coarse_residual = rows.apply(transfer(self.residual(level), index, weights, axis=1))
+        if coarse.solver is not None:
+            coarse.solver.H.fill(0)
+            np.multiply(coarse_residual, coarse.delta ** 2, out=coarse.solver.d2t[1:coarse.solver.vsize + 1])
+        self.v_cycle(l + 1)
+
+        correction = self.prolong(l)
+        if level.solver is not None:
+            level.solver.stripe()[:] += correction
+        self.smooth(level)
+
+    def full_multigrid(self):
+        for level in self.levels[1:]:
+            if level.solver is not None:
+                level.solver.d2t.fill(level.delta ** 2 * self.theta)
+        self.solve_coarsest()
+        for l in reversed(range(len(self.levels) - 1)):
+            initial_guess = self.prolong(l)
+            if self.levels[l].solver is not None:
+                self.levels[l].solver.stripe()[:] = initial_guess
+            self.v_cycle(l)
+
+    def step(self, i, measure_residual=False):
+        """
+        :param measure_residual: sum squares of delta^2 / 4 times the residual into `residual_sq`,
+            the same measure as the Jacobi update
+        """
+        if i == 0 and self.fmg:
+            self.full_multigrid()
+        else:
+            self.v_cycle(0)
+        self.residual_sq = 0.0
+        if measure_residual:
+            residual = self.residual(self.levels[0]).reshape(-1)
+            self.residual_sq = np.dot(residual, residual) * (self.levels[0].delta ** 2 / 4) ** 2
+
+    def close(self):
+        for level in self.levels:
+            if level.solver is not None:
+                level.solver.close()
+                level.comm.Free()
+
+    def stripe(self) -> np.ndarray:
+        return self.levels[0].stripe()
+
+
+CHECKPOINT_MANIFEST = 'manifest.json'
+CHECKPOINT_PREFIX = 'iter_'
+
+
+class Checkpointer:
+    """
+    Periodic checkpoints of the stripes in `checkpoint_dir`/iter_XXXXXXXX, one .npy file per rank.
+    A checkpoint is a snapshot copied out of the grid, written by a background thread while the iterations go on.
+    Once every rank has written its file (checked at the next checkpoint or at `close`),
+    rank 0 writes the manifest, which marks the checkpoint complete, and removes the older checkpoints.
+    """
+
+    def __init__(self, comm, checkpoint_dir: Path, stripe, offset, metadata: dict, start=0):
+        """
+        :param offset: (row, column) of the grid the stripe starts at
+        :param metadata: stored in the manifest, checked by `load_checkpoint`
+        :param start: iteration the run starts at, checkpoints of more iterations are left over by other runs and removed
+        """
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        if self.rank == 0:
+            for other in checkpoint_dir.glob(CHECKPOINT_PREFIX + '*'):
+                if checkpoint_iteration(other) > start:
+                    shutil.rmtree(other, ignore_errors=True)
+        comm.Barrier()
+        self.checkpoint_dir = checkpoint_dir
+        self.snapshot = np.empty(stripe.shape, dtype=stripe.dtype)
+        self.offset = offset
+        self.metadata = metadata
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # (iteration, future of the record of this rank)
+        self.pending = None
+
+    def write(self, directory: Path) -> dict:
+        file_name = f'rank_{self.rank:05d}.npy'
+        np.save(directory.joinpath(file_name), self.snapshot)
+        return {'file': file_name, 'row_offset': int(self.offset[0]), 'col_offset': int(self.offset[1]), 'shape': list(self.snapshot.shape)}
+
+    def save(self, stripe, iteration):
+        """
+        :param iteration: number of iterations the stripe is the result of
+        """
+        # Snapshot is reused, the previous one has to be written first
+        self.complete_pending()
+        np.copyto(self.snapshot, stripe)
+        directory = self.checkpoint_dir.joinpath(f'{CHECKPOINT_PREFIX}{iteration:08d}')
+        directory.mkdir(parents=True, exist_ok=True)
+        self.pending = (iteration, self.executor.submit(self.write, directory))
+
+    def complete_pending(self):
+        if self.pending is None:
+            return
+        iteration, future = self.pending
+        self.pending = None
+        records = self.comm.gather(future.result(), root=0)
+        if self.rank == 0:
+            directory = self.checkpoint_dir.joinpath(f'{CHECKPOINT_PREFIX}{iteration:08d}')
+            manifest = dict(self.metadata, iteration=iteration, blocks=records)
+            tmp_path = directory.joinpath(CHECKPOINT_MANIFEST + '.tmp')
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=1)
+            os.replace(tmp_path, directory.joinpath(CHECKPOINT_MANIFEST))
+            # Ranks may be writing the next checkpoint already
+            for other in self.checkpoint_dir.glob(CHECKPOINT_PREFIX + '*'):
+                if checkpoint_iteration(other) < iteration:
+                    shutil.rmtree(other, ignore_errors=True)
+
+    def close(self):
+        self.complete_pending()
+        self.executor.shutdown()
+
+
+def checkpoint_iteration(directory: Path) -> int:
+    return int(directory.name[len(CHECKPOINT_PREFIX):])
+
+
+def latest_checkpoint(checkpoint_dir: Path) -> Optional[Path]:
+    """
+    :return: directory of the complete checkpoint of the most iterations, None if there is none
+    """
+    complete = [manifest.parent for manifest in checkpoint_dir.glob(f'{CHECKPOINT_PREFIX}*/{CHECKPOINT_MANIFEST}')]
+    return max(complete, key=checkpoint_iteration, default=None)
+
+
+def load_checkpoint(directory: Path, stripe, offset, metadata: dict) -> int:
+    """
+    Fills the stripe from the files of the checkpoint overlapping it, so the checkpoint may come from any
+    number of ranks and any decomposition.
+
+    :param offset: (row, column) of the grid the stripe starts at
+    :return: number of iterations the checkpoint is the result of
+    """
+    with open(directory.joinpath(CHECKPOINT_MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+    for key, value in metadata.items():
+        if manifest[key] != value:
+            raise ValueError(f'Checkpoint {directory} has {key} {manifest[key]}, expected {value}')
 
-        if rank > 0:
-            comm.Isend(H[0].copy(), rank - 1, i)
-        if rank < size - 1:
-            comm.Isend(H[-1].copy(), rank + 1, i)
+    row_begin, col_begin = offset
+    row_end, col_end = row_begin + stripe.shape[0], col_begin + stripe.shape[1]
+    for block in manifest['blocks']:
+        (block_rows, block_cols), block_row, block_col = block['shape'], block['row_offset'], block['col_offset']
+        rows = max(row_begin, block_row), min(row_end, block_row + block_rows)
+        cols = max(col_begin, block_col), min(col_end, block_col + block_cols)
+        if rows[0] < rows[1] and cols[0] < cols[1]:
+            data = np.load(directory.joinpath(block['file']), mmap_mode='r')
+            stripe[rows[0] - row_begin:rows[1] - row_begin, cols[0] - col_begin:cols[1] - col_begin] = \
+                data[rows[0] - block_row:rows[1] - block_row, cols[0] - block_col:cols[1] - block_col]
+    return manifest['iteration']
 
-    return H
+
+SOLUTION_INDEX = 'index.json'
+
+
+class SolutionCache:
+    """
+    Grids `compute` produced for theta * delta^2 == 1, one .npy file per set of the other parameters.
+    With zero boundary conditions every method is linear in the right side, so the grid for any theta and side length
+    is the cached one scaled by theta * delta^2 (up to rounding), with the same relative residual and iterations.
+    Files are written with `write_grid` and read memory-mapped, every rank reads the part under its stripe only.
+    The index, kept by rank 0, orders the entries from the least to the most recently used one,
+    the least recently used files are removed once there are more than `max_entries`.
+    """
+
+    def __init__(self, comm, cache_dir: Path, max_entries=8):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        if self.rank == 0:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def entry_name(parameters: dict) -> str:
+        return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+
+    def path(self, name) -> Path:
+        return self.cache_dir.joinpath(name + '.npy')
+
+    def read_index(self) -> dict:
+        index_path = self.cache_dir.joinpath(SOLUTION_INDEX)
+        if not index_path.exists():
+            return {}
+        with open(index_path) as index_file:
+            return json.load(index_file)
+
+    def write_index(self, index: dict):
+        tmp_path = self.cache_dir.joinpath(SOLUTION_INDEX + '.tmp')
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file, indent=1)
+        os.replace(tmp_path, self.cache_dir.joinpath(SOLUTION_INDEX))
+
+    def load(self, parameters: dict, stripe, offset, scale) -> Optional[tuple]:
+        """
+        Fills the stripe with the cached grid multiplied by `scale`.
+
+        :param parameters: everything but theta and the side length the grid depends on
+        :param offset: (row, column) of the grid the stripe starts at
+        :return: (iterations, relative residual) of the cached grid, None (and the stripe untouched) if it is not cached
+        """
+        name = self.entry_name(parameters)
+        entry = None
+        if self.rank == 0:
+            index = self.read_index()
+            entry = index.pop(name, None)
+            if entry is not None and self.path(name).exists():
+                index[name] = entry
+                self.write_index(index)
+            else:
+                entry = None
+        entry = self.comm.bcast(entry, root=0)
+        if entry is None:
+            return None
+        grid = np.load(self.path(name), mmap_mode='r')
+        row, col = offset
+        np.multiply(grid[row:row + stripe.shape[0], col:col + stripe.shape[1]], scale, out=stripe)
+        return entry['iterations'], entry['residual']
+
+    def store(self, parameters: dict, stripe, offset, grid_points, iterations, residual, columns=None):
+        """
+        Writes the grid as the most recently used entry, evicting the least recently used ones over `max_entries`.
+
+        :param offset: (row, column) of the grid the stripe starts at
+        """
+        name = self.entry_name(parameters)
+        tmp_path = self.cache_dir.joinpath(name + '.tmp.npy')
+        write_grid(self.comm, tmp_path, stripe, offset, grid_points, columns)
+        if self.rank == 0:
+            os.replace(tmp_path, self.path(name))
+            index = self.read_index()
+            index.pop(name, None)
+            index[name] = {'parameters': parameters, 'iterations': iterations, 'residual': residual}
+            while len(index) > self.max_entries:
+                evicted = next(iter(index))
+                del index[evicted]
+                self.path(evicted).unlink(missing_ok=True)
+            self.write_index(index)
+        self.comm.Barrier()
+
+
+def shared_worker(worker, size, delta, grid_points, columns, theta, iters, tol, check_every, kernel, grids, partial_sq, times, barrier,
+                  profiler=None):
+    """
+    Jacobi iterations of the stripe of one worker of `compute_shared`. The ghost rows of the stripe are the edge rows
+    of the neighbouring stripes in the shared grids, so there is nothing to exchange, the workers only wait
+    for each other after every iteration (charged to `halo_wait`).
+    Rows are summed in the same order as by the MPI ranks (see `JacobiSolver`).
+
+    :param times: row `worker` gets the time of every phase, see `Profiler.times`
+    :return: (iterations done, relative residual of the last iteration)
+    """
+    start_time = timer()
+    profiler = profiler if profiler is not None else Profiler()
+    row_offset = sum(vsize_for_rank(r, size, grid_points) for r in range(worker))
+    rows = slice(row_offset, row_offset + vsize_for_rank(worker, size, grid_points) + 2)
+    solver = JacobiSolver(None, worker, size, delta, grid_points, theta, grids=(grids[0, rows], grids[1, rows]), kernel=kernel,
+                          dtype=grids.dtype, columns=columns)
+    residual = float('nan')
+    iterations = iters
+    try:
+        for i in range(iters):
+            check = (tol is not None and (i + 1) % check_every == 0) or i == iters - 1
+            grid_pair = solver.grids[i % 2], solver.grids[(i + 1) % 2]
+            t = timer()
+            # Partial sums alternate, the previous ones may still be read by the slower workers
+            partial_sq[i % 2, worker] = sum(solver.update_rows(begin, end, order, check, grid_pair) for begin, end, order in solver.blocks[0])
+            t = profiler.add('stencil', t)
+            barrier.wait()
+            t = profiler.add('halo_wait', t)
+            converged = False
+            if check:
+                residual = relative_residual(np.sqrt(partial_sq[i % 2].sum()), delta, theta, grid_points, columns)
+                converged = tol is not None and residual <= tol
+                profiler.add('reduce', t)
+            profiler.end_iteration(i)
+            if converged:
+                iterations = i + 1
+                break
+    except BaseException:
+        # Wakes up the other workers instead of leaving them at the barrier
+        barrier.abort()
+        raise
+    times[worker] = profiler.times(timer() - start_time)
+    return iterations, residual
+
+
+def compute_shared(size, delta, grid_points, theta, iters, tol=None, check_every=10, kernel='numpy', dtype=np.float64, profiler=None,
+                   columns=None):
+    """
+    Jacobi iterations on a single node without MPI: `size` worker processes (this one included) update
+    their stripes of two grids in shared memory.
+
+    :param profiler: `Profiler` of this worker, gets the times of the other ones as `peers`
+    :param columns: of the grid, `grid_points` by default
+
+    :return: same as `compute`, the stripe is the whole grid
+    """
+    # Workers are forked, spawned ones would initialize MPI again importing this module
+    context = multiprocessing.get_context('fork')
+    # Zero row above and below the grid, the ghost rows of the first and the last stripe
+    columns = columns or grid_points
+    grid_shape = (2, grid_points + 2, columns)
+    # Partial sums of squares of the residual and times of the phases of every worker, then the grids
+    partial_bytes = (2 + len(PHASES)) * size * np.dtype(np.float64).itemsize
+    memory = shared_memory.SharedMemory(create=True, size=partial_bytes + int(np.prod(grid_shape)) * np.dtype(dtype).itemsize)
+    try:
+        partial_sq = np.ndarray((2, size), dtype=np.float64, buffer=memory.buf)
+        times = np.ndarray((size, len(PHASES)), dtype=np.float64, buffer=memory.buf, offset=partial_sq.nbytes)
+        grids = np.ndarray(grid_shape, dtype=dtype, buffer=memory.buf, offset=partial_bytes)
+        grids.fill(0)
+        partial_sq.fill(0)
+        barrier = context.Barrier(size)
+        args = (size, delta, grid_points, columns, theta, iters, tol, check_every, kernel, grids, partial_sq, times, barrier)
+        workers = [context.Process(target=shared_worker, args=(worker, *args), daemon=True) for worker in range(1, size)]
+        for worker in workers:
+            worker.start()
+        iterations, residual = shared_worker(0, *args, profiler)
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError('Shared memory worker failed')
+        grid = grids[iterations % 2, 1:-1].copy()
+        if profiler is not None:
+            profiler.peers = times[1:].copy()
+        # Views have to be gone before the memory is closed
+        del grids, partial_sq, times
+    finally:
+        memory.close()
+        memory.unlink()
+    return grid, (0, 0), iterations, residual
+
+
+def relative_residual(update_norm, delta, theta, grid_points, columns=None) -> float:
+    """
+    Jacobi (and Gauss-Seidel) update equals delta^2 / 4 times the residual of the previous iterate,
+    the residual norm is divided by the norm of the right side over the interior points.
+    """
+    residual_norm = 4 * update_norm / delta ** 2
+    rhs_norm = abs(theta) * np.sqrt((grid_points - 2) * ((columns or grid_points) - 2))
+    return residual_norm / rhs_norm if rhs_norm > 0 else residual_norm
+
+
+def compute(comm, rank, size, delta, grid_points, theta, iters, overlap=False, decomposition='stripes', tol=None, check_every=10,
+            method='jacobi', omega=None, fmg=False, halo_depth=1, checkpoint_every=None, checkpoint_dir=None, resume=False, threads=1,
+            backend='mpi', kernel='numpy', dtype='float64', refine_every=10, profiler=None, cache=None, columns=None):
+    """
+    :param delta: resolution of the grid
+    :param grid_points: rows of the grid
+    :param method: `jacobi`, `sor` (red-black successive over-relaxation) or `multigrid` (V-cycles, stripes only)
+    :param omega: relaxation factor of SOR, `optimal_omega` by default
+    :param fmg: start multigrid with a full multigrid pass
+    :param halo_depth: ghost rows exchanged every `halo_depth` iterations, see `JacobiSolver`
+    :param threads: worker threads of every rank, see `JacobiSolver`
+    :param tol: stop once the relative residual is below it, checked every `check_every` iterations,
+        `iters` is the limit then
+    :param checkpoint_every: checkpoint the grid into `checkpoint_dir` every that many iterations, see `Checkpointer`
+    :param resume: start from the latest complete checkpoint in `checkpoint_dir`, if there is one
+    :param backend: `mpi` or `shm` - `size` processes on shared memory of this node, see `compute_shared`,
+        jacobi on stripes only
+    :param kernel: stencil kernel of jacobi on stripes, see `KERNELS`
+    :param dtype: `float64`, `float32` or `mixed` - float32 sweeps refined every `refine_every` iterations in float64,
+        see `MixedPrecisionSolver`, jacobi on stripes only
+    :param profiler: `Profiler` timing the phases
+    :param cache: `SolutionCache` the grid is taken from, or stored in once solved for theta * delta^2 == 1 (mpi backend only)
+    :param columns: of the grid, `grid_points` (a square grid) by default, other ones are supported by jacobi on stripes only
+    :return: (stripe, (row, column) of the grid the stripe starts at, iterations done, relative residual of the last iteration)
+    """
+    profiler = profiler if profiler is not None else Profiler()
+    if cache is not None:
+        # Everything else the grid depends on, theta and delta only scale it
+        parameters = {'grid_points': grid_points, 'iters': iters, 'decomposition': decomposition, 'method': method, 'dtype': dtype, 'tol': tol,
+                      'check_every': check_every if tol is not None else None,
+                      'omega': (omega or optimal_omega(grid_points)) if method == 'sor' else None,
+                      'fmg': fmg if method == 'multigrid' else None,
+                      'refine_every': refine_every if dtype == 'mixed' else None}
+        if columns not in (None, grid_points):
+            # Square grids keep the entries cached before
+            parameters['columns'] = columns
+        scale, delta, theta = delta ** 2 * theta, 1.0, 1.0
+    if backend == 'shm':
+        return compute_shared(size, delta, grid_points, theta, iters, tol, check_every, kernel, np.dtype(dtype), profiler, columns)
+    if method == 'multigrid':
+        solver = MultigridSolver(comm, rank, size, delta, grid_points, theta, fmg, profiler)
+    elif method == 'sor':
+        solver = RedBlackSORSolver(comm, rank, size, delta, grid_points, theta, omega or optimal_omega(grid_points), decomposition, profiler)
+    elif decomposition == 'blocks':
+        solver = BlockJacobiSolver(comm, rank, size, delta, grid_points, theta, profiler)
+    elif dtype == 'mixed':
+        solver = MixedPrecisionSolver(comm, rank, size, delta, grid_points, theta, refine_every, kernel, profiler, columns)
+    else:
+        solver = JacobiSolver(comm, rank, size, delta, grid_points, theta, overlap, halo_depth=halo_depth, threads=threads, kernel=kernel,
+                              dtype=np.dtype(dtype), profiler=profiler, columns=columns)
+    offset = (solver.row_offset, solver.col_offset)
+    metadata = {'grid_points': grid_points, 'delta': delta, 'theta': theta}
+    if columns not in (None, grid_points):
+        metadata['columns'] = columns
+    if cache is not None:
+        t = timer()
+        stripe = solver.stripe()
+        cached = cache.load(parameters, stripe, offset, scale)
+        profiler.add('io', t)
+        if cached is not None:
+            solver.close()
+            return stripe, offset, *cached
+
+    start = 0
+    t = timer()
+    if resume:
+        checkpoint = comm.bcast(latest_checkpoint(checkpoint_dir) if rank == 0 else None, root=0)
+        if checkpoint is not None:
+            if checkpoint_iteration(checkpoint) % 2 == 1 and isinstance(solver, (JacobiSolver, BlockJacobiSolver)):
+                # Grids are swapped every iteration and persistent requests expect grid `i % 2` to hold the iterate of iteration i
+                solver.H, solver.H_next = solver.H_next, solver.H
+            start = load_checkpoint(checkpoint, solver.stripe(), offset, metadata)
+            if isinstance(solver, (JacobiSolver, MixedPrecisionSolver)):
+                solver.first_iteration = start
+    checkpointer = Checkpointer(comm, checkpoint_dir, solver.stripe(), offset, metadata, start) if checkpoint_every else None
+    profiler.add('io', t)
+
+    local_sq = np.zeros(1, dtype=np.float64)
+    global_sq = np.zeros(1, dtype=np.float64)
+    residual = float('nan')
+    iterations = iters
+    for i in range(start, iters):
+        check = (tol is not None and (i + 1) % check_every == 0) or i == iters - 1
+        solver.step(i, check)
+        t = timer()
+        converged = False
+        if check:
+            local_sq[0] = solver.residual_sq
+            comm.Allreduce(local_sq, global_sq, op=MPI.SUM)
+            residual = relative_residual(np.sqrt(global_sq[0]), delta, theta, grid_points, columns)
+            converged = tol is not None and residual <= tol
+            t = profiler.add('reduce', t)
+        if not converged and checkpointer is not None and (i + 1) % checkpoint_every == 0:
+            checkpointer.save(solver.stripe(), i + 1)
+            profiler.add('io', t)
+        profiler.end_iteration(i)
+        if converged:
+            iterations = i + 1
+            break
+    t = timer()
+    if checkpointer is not None:
+        checkpointer.close()
+    profiler.add('io', t)
+    solver.close()
+    stripe = solver.stripe()
+    if cache is not None:
+        t = timer()
+        cache.store(parameters, stripe, offset, grid_points, iterations, residual, columns)
+        stripe *= scale
+        profiler.add('io', t)
+    return stripe, offset, iterations, residual
+
+
+def relative_error(comm, stripe, reference) -> float:
+    """
+    :return: max norm of the difference of the grids (of all ranks) relative to the max norm of `reference`
+    """
+    norms = np.array([np.max(np.abs(stripe - reference), initial=0), np.max(np.abs(reference), initial=0)])
+    comm.Allreduce(MPI.IN_PLACE, norms, op=MPI.MAX)
+    return norms[0] / norms[1]
+
+
+def block_buffer(block):
+    """
+    :return: [buffer, count, datatype] of a 2D block of a larger grid (rows contiguous), so that it is sent in place
+        - the datatype has to be freed if it is not a predefined one
+    """
+    element_type = MPI.Datatype.fromcode(block.dtype.char)
+    if block.flags.c_contiguous:
+        return [block, block.size, element_type]
+    rows, columns = block.shape
+    row_stride = block.strides[0] // block.itemsize
+    datatype = element_type.Create_vector(rows, columns, row_stride).Commit()
+    # Memory from the first to the last element of the block, within the grid the block is a view of
+    span = np.lib.stride_tricks.as_strided(block, shape=((rows - 1) * row_stride + columns,), strides=(block.itemsize,))
+    return [span, 1, datatype]
+
+
+def free_buffer(buffer):
+    if not buffer[-1].is_predefined:
+        buffer[-1].Free()
+
+
+def gather_grid(comm, stripe, offset, grid_points, root=0, columns=None) -> Optional[np.ndarray]:
+    """
+    Assembles the grid on `root` without pickling, stripes land straight in a preallocated array with a Gatherv.
+    2D blocks are not contiguous in the grid, `root` receives them with subarray datatypes instead.
+
+    :param offset: (row, column) of the grid the stripe starts at
+    :param columns: of the grid, `grid_points` by default
+    :return: the grid on `root` (of the dtype of the stripes), None elsewhere
+    """
+    columns = columns or grid_points
+    rank = comm.Get_rank()
+    layouts = np.empty((comm.Get_size(), 4), dtype=np.int64)
+    comm.Allgather(np.array([*offset, *stripe.shape], dtype=np.int64), layouts)
+    row_offsets, col_offsets, vsizes, hsizes = layouts.T
+    grid = np.empty((grid_points, columns), dtype=stripe.dtype) if rank == root else None
+    element_type = MPI.Datatype.fromcode(stripe.dtype.char)
+    send_buffer = block_buffer(stripe)
+
+    if np.all(hsizes == columns):
+        counts, displacements = vsizes * columns, row_offsets * columns
+        comm.Gatherv(send_buffer, [grid, (counts, displacements), element_type] if rank == root else None, root)
+    else:
+        requests = [comm.Isend(send_buffer, root)]
+        recv_types = []
+        if rank == root:
+            for source, (row_offset, col_offset, vsize, hsize) in enumerate(layouts):
+                recv_type = element_type.Create_subarray([grid_points, columns], [vsize, hsize], [row_offset, col_offset]).Commit()
+                requests.append(comm.Irecv([grid, 1, recv_type], source))
+                recv_types.append(recv_type)
+        MPI.Request.Waitall(requests)
+        for recv_type in recv_types:
+            recv_type.Free()
+    free_buffer(send_buffer)
+    return grid
+
+
+def write_grid(comm, path, stripe, offset, grid_points, columns=None):
+    """
+    Writes the grid into a .npy file (`np.load(path, mmap_mode='r')` opens it) with collective MPI-IO,
+    every rank writes its stripe at its place in the file, nothing goes through a single rank.
+
+    :param offset: (row, column) of the grid the stripe starts at
+    :param columns: of the grid, `grid_points` by default
+    """
+    columns = columns or grid_points
+    header_file = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header_file, {
+        'descr': np.lib.format.dtype_to_descr(stripe.dtype),
+        'fortran_order': False,
+        'shape': (grid_points, columns),
+    })
+    header = header_file.getvalue()
+
+    fh = MPI.File.Open(comm, str(path), MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    # Truncates whatever was there before
+    fh.Set_size(len(header) + grid_points * columns * stripe.itemsize)
+    if comm.Get_rank() == 0:
+        fh.Write_at(0, [header, MPI.BYTE])
+    element_type = MPI.Datatype.fromcode(stripe.dtype.char)
+    file_type = element_type.Create_subarray([grid_points, columns], list(stripe.shape), list(offset)).Commit()
+    fh.Set_view(len(header), element_type, file_type)
+    buffer = block_buffer(stripe)
+    fh.Write_all(buffer)
+    fh.Close()
+    free_buffer(buffer)
+    file_type.Free()
 
 
 def main():
-    args: Args = build_cli().parse_args()
+    parser = build_cli()
+    args: Args = parser.parse_args()
+    if args.overlap and args.decomposition == 'blocks':
+        parser.error('--overlap is only supported with stripes decomposition')
+    if args.overlap and args.method != 'jacobi':
+        parser.error('--overlap is only supported with jacobi method')
+    if args.method == 'multigrid' and args.decomposition == 'blocks':
+        parser.error('multigrid is only supported with stripes decomposition')
+    if args.halo_depth != 1 and (args.method != 'jacobi' or args.decomposition == 'blocks' or args.overlap):
+        parser.error('--halo-depth is only supported with jacobi method on stripes without --overlap')
+    if args.threads != 1 and (args.method != 'jacobi' or args.decomposition == 'blocks' or args.overlap or args.halo_depth != 1):
+        parser.error('--threads-per-rank is only supported with jacobi method on stripes without --overlap and --halo-depth')
+    if args.check_every < 1:
+        parser.error('--check-every must be at least 1')
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     size = comm.Get_size()
+    if args.columns is not None and args.points_per_rank is None:
+        parser.error('--columns is only supported with --points-per-rank')
+    if args.points_per_rank is not None:
+        if args.method != 'jacobi' or args.decomposition == 'blocks':
+            parser.error('--points-per-rank is only supported with jacobi method on stripes')
+        ranks = args.processes if args.backend == 'shm' else size
+        # Stripe of every rank keeps its shape, so the halo does not grow with the ranks, the grid grows in rows only
+        args.columns = args.columns or int(round(np.sqrt(args.points_per_rank)))
+        args.grid_points = ranks * max(1, int(round(args.points_per_rank / args.columns)))
+        if min(args.grid_points, args.columns) < 3:
+            parser.error('--points-per-rank is too small, the grid needs at least 3 points on every side')
+    else:
+        args.columns = args.grid_points
+    if args.backend == 'shm':
+        if (args.method != 'jacobi' or args.decomposition == 'blocks' or args.overlap or args.halo_depth != 1 or args.threads != 1
+                or args.checkpoint_every is not None or args.resume or args.cache_dir is not None):
+            parser.error('--backend shm is only supported with jacobi method on stripes, without the other options')
+        if size > 1:
+            parser.error('--backend shm starts its own processes, run it without mpiexec')
+        if not 1 <= args.processes <= args.grid_points:
+            parser.error('--processes must be between 1 and the number of grid points')
+        # Grid is assembled by this process alone
+        comm, size = MPI.COMM_SELF, args.processes
+    if args.cache_dir is not None and (args.checkpoint_every is not None or args.resume):
+        parser.error('--cache-dir is not supported with --checkpoint-every and --resume')
+    if args.grid_points < size:
+        parser.error('every rank needs at least one row of the grid')
+    if not 1 <= args.halo_depth <= args.grid_points // size:
+        parser.error(f'--halo-depth must be between 1 and the smallest stripe ({args.grid_points // size} rows)')
+
+    if args.dtype != 'float64' and (args.method != 'jacobi' or args.decomposition == 'blocks'):
+        parser.error('--dtype is only supported with jacobi method on stripes')
+    if args.dtype == 'mixed' and (args.overlap or args.halo_depth != 1 or args.threads != 1 or args.backend == 'shm'):
+        parser.error('--dtype mixed is not supported with --overlap, --halo-depth, --threads-per-rank and --backend shm')
+    if args.refine_every < 1:
+        parser.error('--refine-every must be at least 1')
+    if args.kernel not in ('auto', 'numpy') and (args.method != 'jacobi' or args.decomposition == 'blocks'):
+        parser.error('--kernel is only supported with jacobi method on stripes')
+    if args.kernel not in ('auto', *KERNELS):
+        parser.error(f'{args.kernel} kernel needs {KERNEL_MODULES[args.kernel]} installed')
+
+    # Side is the width in the weak scaling mode, the membrane gets longer with the ranks
+    delta = args.a / (args.columns - 1)
+    # Other solvers have their own NumPy updates
+    kernel = 'numpy'
+    if args.method == 'jacobi' and args.decomposition == 'stripes':
+        # Benchmark (or JIT compilation of the chosen kernel) is setup, not counted in the time
+        kernels = list(KERNELS) if args.kernel == 'auto' else [args.kernel]
+        # Mixed precision does most of the sweeps in float32
+        kernel = select_kernel(comm, vsize_for_rank(rank, size, args.grid_points), args.columns, delta ** 2 * args.theta, kernels,
+                               np.float64 if args.dtype == 'float64' else np.float32)
 
     # print(f'rank {rank} args {args} size {size}')
     # Hey, I'm not counting in argument parsing as sequential part of the program,
@@ -95,26 +1784,42 @@ def main():
 
     # ppc = args.grid_points / size
 
-    delta = args.a / (args.grid_points - 1)
-    # compute_time = timer()
-    stripe = compute(comm, rank, size, delta, args.grid_points, args.theta, args.iters)
-    # compute_time = timer() - compute_time
-
-    # gather_time = timer()
+    cache = SolutionCache(comm, args.cache_dir, args.cache_entries) if args.cache_dir is not None else None
+    profiler = Profiler(trace=args.trace is not None)
+    stripe, offset, iterations, residual = compute(comm, rank, size, delta, args.grid_points, args.theta, args.iters, overlap=args.overlap,
+                                                   decomposition=args.decomposition, tol=args.tol, check_every=args.check_every,
+                                                   method=args.method, omega=args.omega, fmg=args.fmg, halo_depth=args.halo_depth,
+                                                   checkpoint_every=args.checkpoint_every, checkpoint_dir=args.checkpoint_dir, resume=args.resume,
+                                                   threads=args.threads, backend=args.backend, kernel=kernel, dtype=args.dtype,
+                                                   refine_every=args.refine_every, profiler=profiler, cache=cache, columns=args.columns)
 
-    # recv_buff = np.empty((args.grid_points, args.grid_points), dtype=np.float64)
-    # comm.Gather(stripe, recv_buff, root=0)
+    t = timer()
+    if args.output is not None:
+        write_grid(comm, args.output, stripe, offset, args.grid_points, args.columns)
+        profiler.add('io', t)
+    else:
+        gather_grid(comm, stripe, offset, args.grid_points, columns=args.columns)
+        profiler.add('gather', t)
+    elapsed = timer() - start_time  # Result is in seconds, we want to convert it to milis
+    phase_times = profiler.summary(comm, elapsed)
+    if args.trace is not None:
+        profiler.write_trace(comm, args.trace)
 
-    recv_buff = comm.gather(stripe, root=0)
-    # gather_time = timer() - gather_time
+    error = 0.0
+    if args.dtype != 'float64':
+        # Same iterations in float64, not timed
+        reference, _, _, _ = compute(comm, rank, size, delta, args.grid_points, args.theta, iterations, overlap=args.overlap,
+                                     decomposition=args.decomposition, tol=None, check_every=args.check_every, method=args.method,
+                                     omega=args.omega, fmg=args.fmg, halo_depth=args.halo_depth, checkpoint_every=None, checkpoint_dir=None,
+                                     resume=False, threads=args.threads, backend=args.backend, kernel=kernel, cache=cache,
+                                     columns=args.columns)
+        error = relative_error(comm, stripe, reference)
 
     if rank == 0:
-        assert len(recv_buff) > 0
-        # recv_buff = np.concatenate(recv_buff, axis=0)
-        elapsed = timer() - start_time  # Result is in seconds, we want to convert it to milis
         # "process_count,problem_size,series_id,time,compute_time,gather_time"
         # print(f'{size},{args.ppc},{args.series},{elapsed * 1000},{compute_time * 1000},{gather_time * 1000}')
-        print(f'{size},{args.grid_points},{args.series},{elapsed * 1000}')
+        print(csv_row(size, args.grid_points, args.series, elapsed, iterations, residual, kernel, args.dtype, error, phase_times,
+                      args.columns))
 
 
 if __name__ == "__main__":
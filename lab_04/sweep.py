@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+import time
+import argparse
+import numpy as np
+from mpi4py import MPI
+from timeit import default_timer as timer
+from dataclasses import dataclass
+from typing import Optional
+from main import CSV_HEADER, KERNELS, KERNEL_MODULES, Profiler, compute, csv_row, gather_grid, relative_error, select_kernel, vsize_for_rank
+
+
+def build_cli() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="solver-sweep")
+    parser.add_argument('--grid-points', type=int, nargs='+', default=[1024, 2048, 4096], dest='grid_points', help='Problem sizes to run')
+    parser.add_argument('-a', '--side', type=float, default=8192, dest='a', help='Side length of the membrane')
+    parser.add_argument('--theta', type=float, nargs='+', default=[256], dest='thetas',
+                        help='Right sides of the equation, with more than one a theta column is prepended to the CSV')
+    parser.add_argument('--iters', type=int, default=64, dest='iters', help='Number of iterations in iterative method')
+    parser.add_argument('--series-count', type=int, default=5, dest='series_count', help='Measurements of every configuration')
+    parser.add_argument('--process-counts', type=int, nargs='+', default=None, dest='process_counts',
+                        help='Ranks to run every configuration on, every count from 1 to the size of the launch by default')
+    parser.add_argument('--warmup-iters', type=int, default=4, dest='warmup_iters',
+                        help='Iterations of the untimed run done before the series of every configuration')
+    parser.add_argument('--tol', type=float, default=None, dest='tol',
+                        help='Stop once the residual (relative to the right side) drops below this value, --iters becomes the iteration limit')
+    parser.add_argument('--check-every', type=int, default=10, dest='check_every', help='Residual is checked every that many iterations in --tol mode')
+    parser.add_argument('--kernel', type=str, default='auto', choices=['auto'] + list(KERNEL_MODULES), dest='kernel',
+                        help='Stencil kernel, auto picks the fastest installed one for every configuration')
+    parser.add_argument('--dtype', type=str, default='float64', choices=['float64', 'float32', 'mixed'], dest='dtype', help='Precision, see main.py')
+    parser.add_argument('--refine-every', type=int, default=10, dest='refine_every', help='Iterations between the refinements in --dtype mixed')
+    return parser
+
+
+@dataclass
+class Args:
+    grid_points: list
+    a: float
+    thetas: list
+    iters: int
+    series_count: int
+    process_counts: Optional[list]
+    warmup_iters: int
+    tol: Optional[float]
+    check_every: int
+    kernel: str
+    dtype: str
+    refine_every: int
+
+
+def idle_barrier(comm, poll_interval=0.01):
+    """
+    Barrier that sleeps instead of spinning, ranks left out of the measured sub-communicator wait in it
+    without taking CPU time from the measured ones.
+    """
+    request = comm.Ibarrier()
+    while not request.Test():
+        time.sleep(poll_interval)
+
+
+def timed_run(comm, delta, grid_points, theta, iters, kernel, args: Args):
+    """
+    A run timed like a launch of main.py: the solve and the gather of the grid on rank 0, without any setup.
+
+    :return: (elapsed [s], iterations, relative residual, phase times (see `Profiler.summary`), stripe)
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    profiler = Profiler()
+    comm.Barrier()
+    start_time = timer()
+    stripe, offset, iterations, residual = compute(comm, rank, size, delta, grid_points, theta, iters, tol=args.tol, check_every=args.check_every,
+                                                   kernel=kernel, dtype=args.dtype, refine_every=args.refine_every, profiler=profiler)
+    t = timer()
+    gather_grid(comm, stripe, offset, grid_points)
+    profiler.add('gather', t)
+    elapsed = timer() - start_time
+    return elapsed, iterations, residual, profiler.summary(comm, elapsed), stripe
+
+
+def sweep(comm, grid_points, theta, args: Args, prefix=''):
+    """
+    Every series of a (problem size, theta) configuration on the ranks of `comm`, rows are printed by its rank 0.
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    delta = args.a / (grid_points - 1)
+    kernels = list(KERNELS) if args.kernel == 'auto' else [args.kernel]
+    kernel = select_kernel(comm, vsize_for_rank(rank, size, grid_points), grid_points, delta ** 2 * theta, kernels,
+                           np.float64 if args.dtype == 'float64' else np.float32)
+    # Sub-communicator connections, first touch of the grids and caches are paid here, outside of the series
+    compute(comm, rank, size, delta, grid_points, theta, args.warmup_iters, kernel=kernel, dtype=args.dtype, refine_every=args.refine_every)
+
+    # Float64 grids the error is measured against, by iterations done
+    references = {}
+    for series in range(args.series_count):
+        elapsed, iterations, residual, phase_times, stripe = timed_run(comm, delta, grid_points, theta, args.iters, kernel, args)
+        error = 0.0
+        if args.dtype != 'float64':
+            if iterations not in references:
+                references[iterations], _, _, _ = compute(comm, rank, size, delta, grid_points, theta, iterations, check_every=args.check_every,
+                                                          kernel=kernel)
+            error = relative_error(comm, stripe, references[iterations])
+        if rank == 0:
+            print(prefix + csv_row(size, grid_points, series, elapsed, iterations, residual, kernel, args.dtype, error, phase_times), flush=True)
+
+
+def main():
+    parser = build_cli()
+    args: Args = parser.parse_args()
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    world_size = comm.Get_size()
+
+    process_counts = args.process_counts or list(range(1, world_size + 1))
+    if not all(1 <= n <= world_size for n in process_counts):
+        parser.error(f'--process-counts must be between 1 and the number of launched processes ({world_size})')
+    if max(process_counts) > min(args.grid_points):
+        parser.error('every rank needs at least one row of the smallest grid')
+    if args.check_every < 1:
+        parser.error('--check-every must be at least 1')
+    if args.refine_every < 1:
+        parser.error('--refine-every must be at least 1')
+    if args.kernel not in ('auto', *KERNELS):
+        parser.error(f'{args.kernel} kernel needs {KERNEL_MODULES[args.kernel]} installed')
+
+    if rank == 0:
+        print(('theta,' if len(args.thetas) > 1 else '') + CSV_HEADER, flush=True)
+    for n in process_counts:
+        # The first n ranks do the runs, the others wait for them
+        sub_comm = comm.Split(0 if rank < n else MPI.UNDEFINED, rank)
+        if sub_comm != MPI.COMM_NULL:
+            for grid_points in args.grid_points:
+                for theta in args.thetas:
+                    sweep(sub_comm, grid_points, theta, args, f'{theta},' if len(args.thetas) > 1 else '')
+            sub_comm.Free()
+        idle_barrier(comm)
+
+
+if __name__ == "__main__":
+    main()
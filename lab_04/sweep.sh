@@ -0,0 +1,32 @@
+#!/bin/bash -l
+#SBATCH --account=plgar2023-cpu
+#SBATCH --time=00:30:00
+#SBATCH --nodes=1
+#SBATCH --ntasks=16
+#SBATCH --partition=plgrid
+#SBATCH --cpus-per-task=1
+#SBATCH --mem-per-cpu=512M
+
+module purge
+module load scipy-bundle/2021.10-intel-2021b
+# module add .plgrid plgrid/tools/openmpi
+
+# Same matrix as run.sh in a single launch, sub-communicators of 1..16 ranks run it one after the other
+problem_sizes=(1024 2048 4096)
+side_length=8192
+cpu_max_count=16
+series_count=5
+theta=256
+iters=64
+output_dir="${SCRATCH}/ar"
+output_file_base="${output_dir}/$(date +%Y%m%dT%H%M%S)"
+output_file="${output_file_base}.csv"
+
+mkdir -p $output_dir
+
+# sweep.py prints the csv header itself
+echo "[$(date +%Y%m%dT%H%M%S)] Run: mpiexec -np $cpu_max_count ./sweep.py --side $side_length --theta $theta --iters $iters --grid-points ${problem_sizes[*]} --series-count $series_count > $output_file"
+mpiexec -np $cpu_max_count ./sweep.py --side $side_length --theta $theta --iters $iters --grid-points "${problem_sizes[@]}" --series-count $series_count > $output_file
+echo "[$(date +%Y%m%dT%H%M%S)] Done"
+
+zip -q "${output_file_base}.zip" $output_file
@@ -0,0 +1,42 @@
+import sys
+import shutil
+import subprocess
+import numpy as np
+import pytest
+from pathlib import Path
+
+
+MAIN = Path(__file__).resolve().parent.joinpath('main.py')
+SOLVER_ARGS = ['-s', '0', '-a', '8', '--theta', '256']
+
+pytestmark = pytest.mark.skipif(shutil.which('mpiexec') is None, reason='needs mpiexec')
+
+
+def run_solver(process_count, *options) -> subprocess.CompletedProcess:
+    command = ['mpiexec', '-np', str(process_count), sys.executable, str(MAIN)] + SOLVER_ARGS + [str(option) for option in options]
+    return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120)
+
+
+# Grids of a single multigrid level (at most 17 points), whose coarsest level is gathered onto one rank
+@pytest.mark.parametrize('grid_points', [3, 12, 17, 40])
+@pytest.mark.parametrize('process_count', [2, 3])
+def test_multigrid_matches_single_rank(tmp_path, grid_points, process_count):
+    grids = []
+    for n in (1, process_count):
+        output = tmp_path.joinpath(f'grid_{n}.npy')
+        result = run_solver(n, '--grid-points', grid_points, '--iters', 3, '--method', 'multigrid', '--output', output)
+        assert result.returncode == 0, result.stderr
+        grids.append(np.load(output))
+    np.testing.assert_allclose(grids[1], grids[0], rtol=1e-12, atol=1e-12 * np.abs(grids[0]).max())
+
+
+@pytest.mark.parametrize('process_count, options, message', [
+    (1, ['--grid-points', 32, '--iters', 10, '--tol', 1e-3, '--check-every', 0], '--check-every must be at least 1'),
+    (1, ['--grid-points', 32, '--iters', 10, '--dtype', 'mixed', '--refine-every', 0], '--refine-every must be at least 1'),
+    (3, ['--grid-points', 2, '--iters', 10], 'every rank needs at least one row of the grid'),
+    (2, ['--grid-points', 32, '--iters', 10, '--halo-depth', 17], '--halo-depth must be between 1 and the smallest stripe (16 rows)'),
+])
+def test_invalid_options_are_rejected(process_count, options, message):
+    result = run_solver(process_count, *options)
+    assert result.returncode != 0
+    assert message in result.stderr
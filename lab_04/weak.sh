@@ -0,0 +1,43 @@
+#!/bin/bash -l
+#SBATCH --account=plgar2023-cpu
+#SBATCH --time=02:00:00
+#SBATCH --nodes=1
+#SBATCH --ntasks=1
+#SBATCH --partition=plgrid
+#SBATCH --cpus-per-task=16
+#SBATCH --mem-per-cpu=512M
+
+module purge
+module load scipy-bundle/2021.10-intel-2021b
+
+# Weak scaling: every rank keeps a stripe of 256^2, 512^2 or 1024^2 points, the grid grows in rows up to 16 times that
+points_per_rank=(65536 262144 1048576)
+side_length=8192
+cpu_min_count=1
+cpu_max_count=16
+series_count=5
+theta=256
+iters=64
+csv_header="process_count,problem_size,series_id,time,iterations,residual,kernel,dtype,error,points_per_rank,columns,throughput,stencil_min,stencil_mean,stencil_max,halo_wait_min,halo_wait_mean,halo_wait_max,send_min,send_mean,send_max,reduce_min,reduce_mean,reduce_max,gather_min,gather_mean,gather_max,io_min,io_mean,io_max,other_min,other_mean,other_max"
+output_dir="${SCRATCH}/ar"
+output_file_base="${output_dir}/weak_$(date +%Y%m%dT%H%M%S)"
+output_file="${output_file_base}.csv"
+
+mkdir -p $output_dir
+echo $csv_header > $output_file
+
+total_task=$(( "${#points_per_rank[@]}" * (cpu_max_count - cpu_min_count + 1) * series_count ))
+completed_task=0
+
+for (( n_cpu = $cpu_min_count ; n_cpu <= $cpu_max_count ; n_cpu++ )); do
+  for rank_points in "${points_per_rank[@]}"; do
+    for (( series_id = 0 ; series_id < $series_count ; series_id++ )); do
+      echo "[$(date +%Y%m%dT%H%M%S)] Run: mpiexec -np $n_cpu ./main.py --series $series_id --side $side_length --theta $theta --iters $iters --points-per-rank $rank_points >> $output_file"
+      mpiexec -np $n_cpu ./main.py --series $series_id --side $side_length --theta $theta --iters $iters --points-per-rank $rank_points >> $output_file
+      completed_task=$(( $completed_task + 1 ))
+      echo "[$(date +%Y%m%dT%H%M%S)] Completion: $completed_task / $total_task"
+    done
+  done
+done
+
+zip -q "${output_file_base}.zip" $output_file
@@ -1,8 +1,19 @@
+import io
+import os
+import json
+import hashlib
+import mpi4py
 import matplotlib.pyplot as plt
 import argparse
+from itertools import cycle
 from pathlib import Path
 from dataclasses import dataclass
-from polars import DataFrame, col, Config, read_csv
+from typing import Optional
+from polars import DataFrame, LazyFrame, col, lit, coalesce, concat, collect_all, Config, read_csv, scan_parquet, Float64, Int64, String
+
+# Only the phases of the solver are needed, not MPI
+mpi4py.rc.initialize = False
+from main import PHASES
 
 COL_PROCESS_COUNT = 'process_count'
 COL_PROBLEM_SIZE = 'problem_size'
@@ -21,86 +32,278 @@ COL_KF_AVG = COL_KF + '_avg'
 COL_KF_STD = COL_KF + '_std'
 COL_COMPUTE_TIME = 'compute_time'
 COL_GATHER_TIME = 'gather_time'
+COL_SINGLE_TIME = 'single_cpu_time'
+COL_KERNEL = 'kernel'
+COL_DTYPE = 'dtype'
+COL_THETA = 'theta'
+COL_THREADS = 'threads_per_rank'
+COL_HALO_DEPTH = 'halo_depth'
+# Hash of the options of the runs of harness.py
+COL_CONFIG = 'config'
+# Work of the whole run: grid points of the solver, the upper bound of the sieve
+COL_WORK = 'work'
+COL_WORK_PER_PROCESS = 'work_per_process'
+# Grid points of the solver over the process count, kept by every rank in the weak scaling mode
+COL_POINTS_PER_RANK = 'points_per_rank'
+# Columns of the solver grid, the problem size is its rows
+COL_COLUMNS = 'columns'
+# Grid points updated per second by a rank
+COL_THROUGHPUT = 'throughput'
+COL_THROUGHPUT_AVG = COL_THROUGHPUT + '_avg'
+COL_THROUGHPUT_STD = COL_THROUGHPUT + '_std'
+COL_WEAK_EFFECTIVENES = 'weak_effectivenes'
+COL_WEAK_EFFECTIVENES_AVG = COL_WEAK_EFFECTIVENES + '_avg'
+COL_WEAK_EFFECTIVENES_STD = COL_WEAK_EFFECTIVENES + '_std'
+COL_SCALED_SPEEDUP = 'scaled_speedup'
+COL_SCALED_SPEEDUP_AVG = COL_SCALED_SPEEDUP + '_avg'
+COL_SCALED_SPEEDUP_STD = COL_SCALED_SPEEDUP + '_std'
+COL_SERIAL_FRACTION = 'serial_fraction'
+COL_SERIAL_FRACTION_AVG = COL_SERIAL_FRACTION + '_avg'
+COL_SERIAL_FRACTION_STD = COL_SERIAL_FRACTION + '_std'
+COL_TARGET = 'target'
+COL_MACHINE = 'machine'
+COL_VARIANT = 'variant'
+# Columns of the runs in the store, the ones a run file does not have are null.
+# Every phase of the solver (main.PHASES) has _min, _mean and _max columns (over the ranks)
+SCHEMA = {
+    COL_PROCESS_COUNT: Int64,
+    COL_PROBLEM_SIZE: Int64,
+    COL_SERIES_ID: Int64,
+    COL_TIME: Float64,
+    'iterations': Int64,
+    'residual': Float64,
+    COL_KERNEL: String,
+    COL_DTYPE: String,
+    'error': Float64,
+    COL_POINTS_PER_RANK: Float64,
+    COL_COLUMNS: Int64,
+    COL_THROUGHPUT: Float64,
+    COL_THETA: Float64,
+    COL_THREADS: Int64,
+    COL_HALO_DEPTH: Int64,
+    COL_CONFIG: String,
+    COL_WORK: Float64,
+    **{f'{phase}_{stat}': Float64 for phase in PHASES for stat in ['min', 'mean', 'max']},
+}
+# Directories of the store, target=.../machine=.../variant=...
+PARTITIONS = [COL_TARGET, COL_MACHINE, COL_VARIANT]
+# Runs of one scaling series differ in the process count and the problem size only
+SERIES_KEYS = PARTITIONS + [COL_KERNEL, COL_DTYPE, COL_THETA, COL_THREADS, COL_HALO_DEPTH, COL_CONFIG]
+INGESTED_FILE = 'ingested.json'
+MARKERS = ['.', 'x', '^', 's', 'v', 'D', '*', '+']
 
 
 @dataclass
 class Args:
-    input_file: Path
+    input_files: list
+    store: Optional[Path]
+    machine: str
+    variant: str
 
 
 def build_cli():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input-file', type=Path, required=True, dest='input_file', help='Path to input file')
+    parser.add_argument('-i', '--input-file', type=Path, nargs='*', default=[], dest='input_files',
+                        help='CSV files of runs (of main.py, sweep.py, hybrid.sh, halo_sweep.sh or harness.py)')
+    parser.add_argument('--store', type=Path, default=None, dest='store',
+                        help='Parquet dataset the input files are ingested into (once), the whole of it is analysed. '
+                             'Without it the input files alone are analysed')
+    parser.add_argument('--machine', type=str, default='default', dest='machine', help='Machine the input files were measured on')
+    parser.add_argument('--variant', type=str, default='default', dest='variant', help='Solver variant of the input files, e.g. overlap or blocks')
     return parser
 
 
-def get_single_cpu_time(df: DataFrame) -> DataFrame:
-    problem_sizes = (
-        df.lazy()
-        .filter((col(COL_PROCESS_COUNT) == 1))
-        .group_by(col(COL_PROBLEM_SIZE))
+def read_run_file(path: Path) -> tuple:
+    """
+    Rows cut off by a killed job (see harness.py) are skipped.
+
+    :return: (target - `solver` or `sieve`, the runs in the columns of `SCHEMA`)
+    """
+    lines = path.read_text().splitlines()
+    n_columns = len(lines[0].split(','))
+    rows = [line for line in lines[1:] if len(line.split(',')) == n_columns]
+    df = read_csv(io.BytesIO('\n'.join([lines[0]] + rows).encode()), has_header=True, infer_schema_length=None)
+    target = 'solver'
+    work_exponent = 2
+    if 'upper_bound' in df.columns:
+        target = 'sieve'
+        work_exponent = 1
+        df = df.rename({'upper_bound': COL_PROBLEM_SIZE})
+    df = df.with_columns((col(COL_PROBLEM_SIZE).cast(Float64) ** work_exponent).alias(COL_WORK))
+    if COL_COLUMNS in df.columns:
+        # Problem size is the rows of a grid that is not square in the weak scaling mode
+        df = df.with_columns((col(COL_PROBLEM_SIZE).cast(Float64) * col(COL_COLUMNS)).alias(COL_WORK))
+    return target, df.select([(col(name).cast(dtype) if name in df.columns else lit(None, dtype=dtype)).alias(name) for name, dtype in SCHEMA.items()])
+
+
+def ingest(store: Path, paths, machine, variant):
+    """
+    Converts every run file into a Parquet file in the partition of its target, machine and variant.
+    Files ingested before are skipped, unless they changed since (e.g. a harness.py store that grew) or got other labels.
+    """
+    ingested_path = store.joinpath(INGESTED_FILE)
+    ingested = json.loads(ingested_path.read_text()) if ingested_path.exists() else {}
+    for path in paths:
+        key = str(path.resolve())
+        stat = path.stat()
+        signature = [stat.st_size, stat.st_mtime_ns, machine, variant]
+        if key in ingested and ingested[key]['signature'] == signature:
+            continue
+        target, df = read_run_file(path)
+        partition = store.joinpath(f'{COL_TARGET}={target}', f'{COL_MACHINE}={machine}', f'{COL_VARIANT}={variant}')
+        partition.mkdir(parents=True, exist_ok=True)
+        parquet_path = partition.joinpath(f'{path.stem}-{hashlib.sha1(key.encode()).hexdigest()[:12]}.parquet')
+        df.write_parquet(parquet_path)
+        parquet_file = str(parquet_path.relative_to(store))
+        if key in ingested and ingested[key]['parquet'] != parquet_file:
+            store.joinpath(ingested[key]['parquet']).unlink(missing_ok=True)
+        ingested[key] = {'signature': signature, 'parquet': parquet_file}
+        print(f'Ingested {path}: {len(df)} runs')
+
+    tmp_path = store.joinpath(INGESTED_FILE + '.tmp')
+    tmp_path.write_text(json.dumps(ingested, indent=1))
+    os.replace(tmp_path, ingested_path)
+
+
+def scan_runs(args: Args) -> LazyFrame:
+    if args.store is not None:
+        # Files ingested by older versions may miss some columns of `SCHEMA`
+        return scan_parquet(args.store.joinpath('**', '*.parquet'), schema=SCHEMA, hive_partitioning=True,
+                            hive_schema={partition: String for partition in PARTITIONS}, missing_columns='insert')
+    frames = []
+    for path in args.input_files:
+        target, df = read_run_file(path)
+        frames.append(df.with_columns([lit(target).alias(COL_TARGET), lit(args.machine).alias(COL_MACHINE), lit(args.variant).alias(COL_VARIANT)]))
+    return concat(frames).lazy()
+
+
+def strong_scaling(runs: LazyFrame) -> LazyFrame:
+    """
+    Speedup, efficiency and Karp-Flatt metric of every run against the mean time of one process on the same problem size,
+    mean and standard deviation over the series.
+    """
+    keys = SERIES_KEYS + [COL_PROBLEM_SIZE]
+    single_cpu_times = (
+        runs
+        .filter(col(COL_PROCESS_COUNT) == 1)
+        .group_by(keys)
         .agg([
-            col(COL_TIME).mean().alias(COL_TIME_AVG)
+            col(COL_TIME).mean().alias(COL_SINGLE_TIME)
         ])
-        .sort(COL_PROBLEM_SIZE)
-        .collect()
     )
-    return problem_sizes
+    return (
+        runs
+        .join(single_cpu_times, on=keys, nulls_equal=True)
+        .with_columns([
+            (col(COL_SINGLE_TIME) / col(COL_TIME)).alias(COL_SPEEDUP)
+        ])
+        .with_columns([
+            (col(COL_SPEEDUP) / col(COL_PROCESS_COUNT)).alias(COL_EFFECTIVENES),
+            (((1 / col(COL_SPEEDUP)) - (1 / col(COL_PROCESS_COUNT))) / (1 - (1 / col(COL_PROCESS_COUNT)))).alias(COL_KF)
+        ])
+        .group_by(keys + [COL_PROCESS_COUNT])
+        .agg([
+            col(COL_SINGLE_TIME).first(),
+            col(COL_TIME).mean().alias(COL_TIME_AVG),
+            col(COL_TIME).std().alias(COL_TIME_STD),
+            col(COL_SPEEDUP).mean().alias(COL_SPEEDUP_AVG),
+            col(COL_SPEEDUP).std().alias(COL_SPEEDUP_STD),
+            col(COL_EFFECTIVENES).mean().alias(COL_EFFECTIVENES_AVG),
+            col(COL_EFFECTIVENES).std().alias(COL_EFFECTIVENES_STD),
+            col(COL_KF).mean().alias(COL_KF_AVG),
+            col(COL_KF).std().alias(COL_KF_STD)
+        ])
+        .sort(keys + [COL_PROCESS_COUNT])
+    )
 
 
-def main():
-    args: Args = build_cli().parse_args()
-    Config.set_tbl_rows(100)
-    Config.set_tbl_cols(20)
-    plt.rcParams['figure.figsize'] = (16, 9)
-    plt.rcParams["errorbar.capsize"] = 2
+def weak_scaling(runs: LazyFrame) -> LazyFrame:
+    """
+    Runs of the same work per process (points per rank of the solver) compared with the mean time of one process doing that work.
+    Weak efficiency is that time over the time of the run, Gustafson's scaled speedup is the process count p times it
+    and the serial fraction it implies is (p - scaled speedup) / (p - 1). Mean and standard deviation over the series,
+    of the work per process measured on more than one process count only.
+    """
+    keys = SERIES_KEYS + [COL_WORK_PER_PROCESS]
+    runs = runs.with_columns([
+        coalesce(col(COL_POINTS_PER_RANK), col(COL_WORK) / col(COL_PROCESS_COUNT)).alias(COL_WORK_PER_PROCESS)
+    ])
+    single_cpu_times = (
+        runs
+        .filter(col(COL_PROCESS_COUNT) == 1)
+        .group_by(keys)
+        .agg([
+            col(COL_TIME).mean().alias(COL_SINGLE_TIME)
+        ])
+    )
+    return (
+        runs
+        .join(single_cpu_times, on=keys, nulls_equal=True)
+        .with_columns([
+            (col(COL_SINGLE_TIME) / col(COL_TIME)).alias(COL_WEAK_EFFECTIVENES)
+        ])
+        .with_columns([
+            (col(COL_PROCESS_COUNT) * col(COL_WEAK_EFFECTIVENES)).alias(COL_SCALED_SPEEDUP)
+        ])
+        .with_columns([
+            ((col(COL_PROCESS_COUNT) - col(COL_SCALED_SPEEDUP)) / (col(COL_PROCESS_COUNT) - 1)).alias(COL_SERIAL_FRACTION)
+        ])
+        .group_by(keys + [COL_PROCESS_COUNT])
+        .agg([
+            col(COL_PROBLEM_SIZE).first(),
+            col(COL_TIME).mean().alias(COL_TIME_AVG),
+            col(COL_TIME).std().alias(COL_TIME_STD),
+            col(COL_WEAK_EFFECTIVENES).mean().alias(COL_WEAK_EFFECTIVENES_AVG),
+            col(COL_WEAK_EFFECTIVENES).std().alias(COL_WEAK_EFFECTIVENES_STD),
+            col(COL_SCALED_SPEEDUP).mean().alias(COL_SCALED_SPEEDUP_AVG),
+            col(COL_SCALED_SPEEDUP).std().alias(COL_SCALED_SPEEDUP_STD),
+            col(COL_SERIAL_FRACTION).mean().alias(COL_SERIAL_FRACTION_AVG),
+            col(COL_SERIAL_FRACTION).std().alias(COL_SERIAL_FRACTION_STD),
+            col(COL_THROUGHPUT).mean().alias(COL_THROUGHPUT_AVG),
+            col(COL_THROUGHPUT).std().alias(COL_THROUGHPUT_STD)
+        ])
+        .filter(col(COL_PROCESS_COUNT).count().over(keys) > 1)
+        .sort(keys + [COL_PROCESS_COUNT])
+    )
+
+
+def phase_times(runs: LazyFrame) -> LazyFrame:
+    """
+    Mean time of every phase (over the ranks, averaged over the series), of the runs that have them.
+    """
+    return (
+        runs
+        .filter(col(f'{PHASES[0]}_mean').is_not_null())
+        .group_by(SERIES_KEYS + [COL_PROBLEM_SIZE, COL_PROCESS_COUNT])
+        .agg([col(f'{phase}_mean').mean() for phase in PHASES])
+        .sort(SERIES_KEYS + [COL_PROBLEM_SIZE, COL_PROCESS_COUNT])
+    )
+
+
+def series_name(keys) -> str:
+    return '_'.join(str(value) for value in keys if value is not None)
 
-    # process_count,problem_size,series_id,time
-    df_main = read_csv(args.input_file, has_header=True).sort([col(COL_PROCESS_COUNT), col(COL_PROBLEM_SIZE)])
-    df_single_cpu_time = get_single_cpu_time(df_main)
-    problem_sizes = df_single_cpu_time.get_column(COL_PROBLEM_SIZE)
-    single_cpu_times = df_single_cpu_time.get_column(COL_TIME_AVG)
 
+def plot_strong(df: DataFrame, title: str, output_path: Path):
+    """
+    Time, speedup, efficiency and Karp-Flatt metric against the process count, every problem size of a series.
+    """
     fig, axes = plt.subplots(nrows=2, ncols=2)
+    fig.suptitle(title)
     common_plot_args = {'capthick': 1.4, 'linestyle': ''}
-    markers = ['.', 'x', '^']
-    colors = 'rgb'
-    assert len(markers) == len(problem_sizes)
-
-    for i, (problem_size, m, c) in enumerate(zip(problem_sizes, markers, colors)):
-        df_per_size = df_main.filter(col(COL_PROBLEM_SIZE) == problem_size)
-        df_per_size = (
-            df_per_size.lazy()
-            .with_columns([
-                (single_cpu_times.item(i) / col(COL_TIME)).alias(COL_SPEEDUP)
-            ])
-            .with_columns([
-                (col(COL_SPEEDUP) / col(COL_PROCESS_COUNT)).alias(COL_EFFECTIVENES),
-                (((1 / col(COL_SPEEDUP)) - (1 / col(COL_PROCESS_COUNT))) / (1 - (1 / col(COL_PROCESS_COUNT)))).alias(COL_KF)
-            ])
-            .group_by([col(COL_PROCESS_COUNT), col(COL_PROBLEM_SIZE)])
-            .agg([
-                col(COL_TIME).mean().alias(COL_TIME_AVG),
-                col(COL_TIME).std().alias(COL_TIME_STD),
-                col(COL_SPEEDUP).mean().alias(COL_SPEEDUP_AVG),
-                col(COL_SPEEDUP).std().alias(COL_SPEEDUP_STD),
-                col(COL_EFFECTIVENES).mean().alias(COL_EFFECTIVENES_AVG),
-                col(COL_EFFECTIVENES).std().alias(COL_EFFECTIVENES_STD),
-                col(COL_KF).mean().alias(COL_KF_AVG),
-                col(COL_KF).std().alias(COL_KF_STD)
-            ])
-            .sort(col(COL_PROCESS_COUNT))
-            .collect()
-        )
+    colors = cycle(plt.rcParams['axes.prop_cycle'].by_key()['color'])
+
+    sizes = df.partition_by(COL_PROBLEM_SIZE, as_dict=True, maintain_order=True).items()
+    for i, (((problem_size,), df_per_size), m, c) in enumerate(zip(sizes, cycle(MARKERS), colors)):
+        single_cpu_time = df_per_size.get_column(COL_SINGLE_TIME).item(0)
 
         ax: plt.Axes = axes[0][0]
         x_data = df_per_size.get_column(COL_PROCESS_COUNT)
         y_data = df_per_size.get_column(COL_TIME_AVG)
         y_err_data = df_per_size.get_column(COL_TIME_STD)
 
-        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=markers[i], color=c, **common_plot_args)
-        ax.plot(x_data, [single_cpu_times.item(i) / x for x in x_data], label='y = t_0 / x', linestyle='--', color=c)
-        # ax.plot(x_data, [single_cpu_times.item(i) / x for x in x_data], linestyle='--')
+        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=m, color=c, **common_plot_args)
+        ax.plot(x_data, [single_cpu_time / x for x in x_data], label='y = t_0 / x', linestyle='--', color=c)
         ax.set(
             title='Czas wykonania w zależności od liczby procesorów',
             xlabel='Liczba procesorów',
@@ -112,7 +315,7 @@ def main():
         ax = axes[0][1]
         y_data = df_per_size[COL_SPEEDUP_AVG]
         y_err_data = df_per_size[COL_SPEEDUP_STD]
-        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=markers[i], color=c, **common_plot_args)
+        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=m, color=c, **common_plot_args)
         if i == 0:
             ax.plot(x_data, [x for x in x_data], label='y = x', linestyle='--')
         ax.set(
@@ -126,7 +329,7 @@ def main():
         ax = axes[1][0]
         y_data = df_per_size[COL_EFFECTIVENES_AVG]
         y_err_data = df_per_size[COL_EFFECTIVENES_STD]
-        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=markers[i], color=c, **common_plot_args)
+        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=m, color=c, **common_plot_args)
         if i == 0:
             ax.plot(x_data, [1 for _ in x_data], label='y = 1', linestyle='--')
         ax.set(
@@ -140,7 +343,7 @@ def main():
         ax = axes[1][1]
         y_data = df_per_size[COL_KF_AVG]
         y_err_data = df_per_size[COL_KF_STD]
-        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=markers[i], color=c, **common_plot_args)
+        ax.errorbar(x_data, y_data, yerr=y_err_data, label=f'Rozmiar: {problem_size}', marker=m, color=c, **common_plot_args)
         if i == 0:
             ax.plot(x_data, [0 for _ in x_data], label='y = 0', linestyle='--')
         ax.set(
@@ -151,10 +354,122 @@ def main():
         ax.grid()
         ax.legend()
 
-        print(df_per_size)
+    print(df)
+    fig.tight_layout()
+    fig.savefig(output_path)
+
+
+def plot_weak(df: DataFrame, title: str, output_path: Path):
+    """
+    Weak efficiency, Gustafson's scaled speedup, the serial fraction and the throughput of a rank
+    against the process count, every work per process of a series.
+    """
+    fig, axes = plt.subplots(nrows=2, ncols=2)
+    fig.suptitle(title)
+    common_plot_args = {'capthick': 1.4, 'linestyle': ''}
+    colors = cycle(plt.rcParams['axes.prop_cycle'].by_key()['color'])
+
+    works = df.partition_by(COL_WORK_PER_PROCESS, as_dict=True, maintain_order=True).items()
+    for i, (((work_per_process,), df_per_work), m, c) in enumerate(zip(works, cycle(MARKERS), colors)):
+        x_data = df_per_work.get_column(COL_PROCESS_COUNT)
+        label = f'Praca na proces: {work_per_process:.4g}'
+        panels = [
+            (axes[0][0], COL_WEAK_EFFECTIVENES_AVG, COL_WEAK_EFFECTIVENES_STD, [1 for _ in x_data], 'y = 1'),
+            (axes[0][1], COL_SCALED_SPEEDUP_AVG, COL_SCALED_SPEEDUP_STD, [x for x in x_data], 'y = x'),
+            (axes[1][0], COL_SERIAL_FRACTION_AVG, COL_SERIAL_FRACTION_STD, [0 for _ in x_data], 'y = 0'),
+        ]
+        for ax, column_avg, column_std, reference, reference_label in panels:
+            ax.errorbar(x_data, df_per_work[column_avg], yerr=df_per_work[column_std], label=label, marker=m, color=c, **common_plot_args)
+            if i == 0:
+                ax.plot(x_data, reference, label=reference_label, linestyle='--')
+
+        # Runs of the sieve and older runs of the solver have no throughput
+        single_cpu_throughput = df_per_work.get_column(COL_THROUGHPUT_AVG).item(0)
+        if single_cpu_throughput is not None:
+            ax = axes[1][1]
+            ax.errorbar(x_data, df_per_work[COL_THROUGHPUT_AVG], yerr=df_per_work[COL_THROUGHPUT_STD], label=label, marker=m, color=c,
+                        **common_plot_args)
+            ax.plot(x_data, [single_cpu_throughput for _ in x_data], label='y = v_0', linestyle='--', color=c)
+
+    for ax, ax_title, ylabel in [(axes[0][0], 'Efektywność skalowania słabego', 'Efektywność'),
+                                 (axes[0][1], 'Przyśpieszenie skalowane (Gustafson)', 'Przyśpieszenie'),
+                                 (axes[1][0], 'Część sekwencyjna', 'Wartość metryki'),
+                                 (axes[1][1], 'Przepustowość procesu', 'Aktualizacje punktów siatki na sekundę')]:
+        ax.set(
+            title=ax_title,
+            xlabel='Liczba procesorów',
+            ylabel=ylabel
+        )
+        ax.grid()
+        if ax.has_data():
+            ax.legend()
+
+    print(df)
+    fig.tight_layout()
+    fig.savefig(output_path)
+
+
+def plot_phases(df: DataFrame, title: str, output_path: Path):
+    """
+    Stacked mean time of every phase (over the ranks, averaged over the series) against the process count,
+    one plot per problem size.
+    """
+    problem_sizes = df.get_column(COL_PROBLEM_SIZE).unique(maintain_order=True)
+    fig, axes = plt.subplots(nrows=1, ncols=len(problem_sizes), squeeze=False)
+    fig.suptitle(title)
+    for ax, problem_size in zip(axes[0], problem_sizes):
+        df_phases = df.filter(col(COL_PROBLEM_SIZE) == problem_size)
+        x_data = df_phases.get_column(COL_PROCESS_COUNT).to_numpy()
+        bottom = 0
+        for phase in PHASES:
+            y_data = df_phases.get_column(f'{phase}_mean').to_numpy()
+            ax.bar(x_data, y_data, bottom=bottom, label=phase)
+            bottom = bottom + y_data
+        ax.set(
+            title=f'Czas faz, rozmiar: {problem_size}',
+            xlabel='Liczba procesorów',
+            ylabel='Średni czas na proces [ms]'
+        )
+        ax.grid(axis='y')
+        ax.legend()
+        print(df_phases)
 
     fig.tight_layout()
-    fig.savefig(args.input_file.parent.joinpath(args.input_file.stem).with_suffix('.png'))
+    fig.savefig(output_path)
+
+
+def main():
+    parser = build_cli()
+    args: Args = parser.parse_args()
+    if args.store is None and len(args.input_files) == 0:
+        parser.error('give input files, a store or both')
+    Config.set_tbl_rows(100)
+    Config.set_tbl_cols(20)
+    plt.rcParams['figure.figsize'] = (16, 9)
+    plt.rcParams["errorbar.capsize"] = 2
+
+    if args.store is not None:
+        args.store.mkdir(parents=True, exist_ok=True)
+        ingest(args.store, args.input_files, args.machine, args.variant)
+        output_base = args.store.joinpath('scaling')
+    else:
+        output_base = args.input_files[0].parent.joinpath(args.input_files[0].stem)
+
+    # One pass over the runs for all of them
+    runs = scan_runs(args)
+    df_strong, df_weak, df_phases = collect_all([strong_scaling(runs), weak_scaling(runs), phase_times(runs)])
+
+    strong_series = df_strong.partition_by(SERIES_KEYS, as_dict=True, maintain_order=True)
+    # Plots of a single input file of a single series keep its name
+    single_series = args.store is None and len(strong_series) == 1
+    for keys, df in strong_series.items():
+        suffix = '' if single_series else f'_{series_name(keys)}'
+        plot_strong(df, series_name(keys), Path(f'{output_base}{suffix}.png'))
+    for keys, df in df_weak.partition_by(SERIES_KEYS, as_dict=True, maintain_order=True).items():
+        plot_weak(df, series_name(keys), Path(f'{output_base}_{series_name(keys)}_weak.png'))
+    for keys, df in df_phases.partition_by(SERIES_KEYS, as_dict=True, maintain_order=True).items():
+        suffix = '' if single_series else f'_{series_name(keys)}'
+        plot_phases(df, series_name(keys), Path(f'{output_base}{suffix}_phases.png'))
     plt.show()
 
 
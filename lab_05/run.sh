@@ -22,7 +22,7 @@ cpu_max_count=32
 series_count=1
 theta=256
 iters=64
-csv_header="process_count,problem_size,series_id,time"
+csv_header="process_count,problem_size,series_id,time,iterations,residual,kernel,dtype,error,points_per_rank,columns,throughput,stencil_min,stencil_mean,stencil_max,halo_wait_min,halo_wait_mean,halo_wait_max,send_min,send_mean,send_max,reduce_min,reduce_mean,reduce_max,gather_min,gather_mean,gather_max,io_min,io_mean,io_max,other_min,other_mean,other_max"
 output_dir="${SCRATCH}/ar"
 output_file_base="${output_dir}/$(date +%Y%m%dT%H%M%S)"
 output_file="${output_dir}/$(date +%Y%m%dT%H%M%S).csv"